@@ -1,14 +1,31 @@
 import json
+import logging
+import math
 import re
 import os
+import subprocess
+import numpy as np
 import torch
-import tempfile
-import whisper
-from google import genai
 from google.genai import types
-from concurrent.futures import ThreadPoolExecutor
-from nsfw_detector import main as nsfw_detector
-from violence_detector import main as violence_detector
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+import nsfw_detector as nsfw_module
+import violence_detector as violence_module
+from nsfw_detector import load_models as load_nsfw_models, VIT_MODEL_NAME, PIPELINE_MODEL_NAME
+from violence_detector import get_model as load_violence_model, current_model_path as current_violence_model_path, VIOLENCE_WINDOW_THRESHOLD
+from result_cache import ResultCache, hash_file, make_key
+from asr import get_backend as get_asr_backend, ASR_BACKEND, ASR_MODEL_SIZE, SAMPLE_RATE as AUDIO_SAMPLE_RATE
+from model_registry import registry
+from onnx_runtime import INFERENCE_RUNTIME, ONNX_QUANTIZED
+from telemetry import span, in_context, emit, GEMINI_TOKENS
+from stage_graph import StageGraph
+import detector_pool
+import video_scan
+import verdict
+from verdict import verdict_scope, VerdictReached
+from gemini_client import get_client as get_gemini_client, calculate_cost, GEMINI_TIMEOUT, GEMINI_MAX_CONCURRENCY
+from transcript_chunks import split_transcript, merge_results, GEMINI_CHUNK_TOKENS
 from prompts import (
     For_All_Sys_Instructions,
     Abusive_Content_Sys_Instructions,
@@ -16,37 +33,100 @@ from prompts import (
     NSFW_Sys_Instructions,
     Politics_Sys_Instructions,
     Religious_Sys_Instructions,
+    Combined_Sys_Instructions,
 )
 
+logger = logging.getLogger(__name__)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"[INFO] Using device: {device}")
-whisper_model = whisper.load_model("medium", device=device)
-print("[INFO] Whisper model loaded successfully.")
-
-def calculate_cost(input_tokens, output_tokens):
-    input_price = 0.075 if input_tokens <= 128000 else 0.15
-    output_price = 0.30 if output_tokens <= 128000 else 0.60
-    cost = ((input_tokens / 1_000_000.0) * input_price) + ((output_tokens / 1_000_000.0) * output_price)
-    return round(cost, 8), round(cost, 8) * 280.0
-
-def run_detection_models(video_path, violence_model_path, detect_nsfw, detect_violent):
-    print("[INFO] Running detection models...")
-    nsfw_result, violence_result = None, None
-    with ThreadPoolExecutor() as executor:
-        futures = {}
-        if detect_nsfw:
-            print("[INFO] Starting NSFW detection...")
-            futures["nsfw"] = executor.submit(nsfw_detector, video_path=video_path)
-        if detect_violent:
-            print("[INFO] Starting Violence detection...")
-            futures["violence"] = executor.submit(violence_detector, model_path=violence_model_path, video_path=video_path)
-        nsfw_result = futures.get("nsfw").result() if "nsfw" in futures else None
-        violence_result = futures.get("violence").result() if "violence" in futures else None
-    print("[INFO] Detection models completed.")
-    return nsfw_result, violence_result
-
-def analyze_text_with_gemini(urdu_text, api_key, sys_instruct):
-    print("[INFO] Sending text for Gemini analysis...")
+logger.info(f"Using device: {device}")
+# Models load on first use (or via warmup); these are the ones each detector needs.
+MODEL_LOADERS = {
+    "asr": get_asr_backend,
+    "nsfw": load_nsfw_models,
+    "violence": load_violence_model,
+}
+DETECTOR_MODELS = {
+    "abusive": ["asr"],
+    "violent": ["asr", "violence"],
+    "nsfw": ["asr", "nsfw"],
+    "political": ["asr"],
+    "religious": ["asr"],
+}
+# Registry entries each loader leaves resident.
+MODEL_REGISTRY_NAMES = {
+    "asr": ["asr"],
+    "nsfw": ["nsfw_vit", "nsfw_pipeline"],
+    "violence": ["violence"],
+}
+# Comma-separated detectors whose models load at server startup, or "all"; empty keeps everything lazy.
+PRELOAD_DETECTORS = os.environ.get("PRELOAD_DETECTORS", "")
+
+GEMINI_MODEL = 'gemini-1.5-flash-002'
+# "per_category" sends one request per category; "combined" sends all selected categories in one request.
+GEMINI_MODES = ("per_category", "combined")
+GEMINI_MODE = os.environ.get("GEMINI_MODE", "per_category")
+
+def validate_gemini_mode(mode):
+    """Returns `mode`, or GEMINI_MODE if it is empty; unknown modes raise ValueError rather than fragmenting the cache."""
+    mode = mode or GEMINI_MODE
+    if mode not in GEMINI_MODES:
+        raise ValueError(f"Unknown Gemini mode '{mode}'; choose from {', '.join(GEMINI_MODES)}")
+    return mode
+
+validate_gemini_mode(GEMINI_MODE)
+_gemini_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("GEMINI_MAX_WORKERS", 16)), thread_name_prefix="gemini")
+analysis_cache = ResultCache("analysis_results")
+gemini_cache = ResultCache("gemini_results")
+
+def model_versions():
+    """Everything besides the video bytes and flags that can change an analyze_video result."""
+    return {
+        "asr": [ASR_BACKEND, ASR_MODEL_SIZE],
+        "gemini": GEMINI_MODEL,
+        "nsfw": [VIT_MODEL_NAME, PIPELINE_MODEL_NAME],
+        "violence": current_violence_model_path(),
+        "runtime": [INFERENCE_RUNTIME, ONNX_QUANTIZED],
+        # Detector modes change verdicts too, so a config change must not serve stale results.
+        "nsfw_config": [nsfw_module.NSFW_SAMPLING, nsfw_module.NSFW_EARLY_EXIT, nsfw_module.NSFW_EARLY_EXIT_ALPHA,
+                        nsfw_module.NSFW_EARLY_EXIT_SAMPLE, nsfw_module.NSFW_ENSEMBLE],
+        "violence_config": [violence_module.VIOLENCE_WINDOWED, violence_module.VIOLENCE_WINDOW_STRIDE,
+                            violence_module.VIOLENCE_MAX_WINDOWS],
+    }
+
+def models_for_detectors(detectors):
+    if detectors == "all":
+        detectors = list(DETECTOR_MODELS)
+    elif isinstance(detectors, str):
+        detectors = [d.strip() for d in detectors.split(",") if d.strip()]
+    unknown = [d for d in detectors if d not in DETECTOR_MODELS]
+    if unknown:
+        raise ValueError(f"Unknown detectors: {', '.join(unknown)}")
+    return sorted({name for d in detectors for name in DETECTOR_MODELS[d]})
+
+def warmup(detectors="all"):
+    """Loads the models the given detectors need and returns the resident models."""
+    for name in models_for_detectors(detectors):
+        start = time.monotonic()
+        MODEL_LOADERS[name]()
+        logger.info(f"Warmed up {name} in {time.monotonic() - start:.2f}s")
+    return registry.loaded()
+
+if PRELOAD_DETECTORS:
+    # Fail at startup on a typo rather than from every /ready call.
+    models_for_detectors(PRELOAD_DETECTORS)
+
+def models_ready(detectors):
+    resident = registry.loaded()
+    return all(entry in resident for name in models_for_detectors(detectors) for entry in MODEL_REGISTRY_NAMES[name])
+
+def record_gemini_usage(response, mode):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        GEMINI_TOKENS.inc(usage.prompt_token_count or 0, direction="input", mode=mode)
+        GEMINI_TOKENS.inc(usage.candidates_token_count or 0, direction="output", mode=mode)
+
+def analyze_text_with_gemini(urdu_text, api_key, sys_instruct, deadline=None):
+    logger.info("Sending text for Gemini analysis...")
     prompt = (
         "Analyze this Urdu transcript for harmful content: "
         f"{urdu_text}"
@@ -61,128 +141,627 @@ def analyze_text_with_gemini(urdu_text, api_key, sys_instruct):
         " Return: Result."
     )
     try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model='gemini-1.5-flash-002',
+        client = get_gemini_client(api_key)
+        response = client.generate_content(
+            model=GEMINI_MODEL,
             config=types.GenerateContentConfig(system_instruction=sys_instruct, temperature=0.0),
             contents=prompt,
+            deadline=deadline,
         )
-        print("[INFO] Gemini analysis complete.")
+        record_gemini_usage(response, "per_category")
+        logger.info("Gemini analysis complete.")
         return response
     except Exception as e:
-        print(f"[ERROR] Gemini analysis failed: {e}")
+        logger.error(f"Gemini analysis failed: {e}")
         return f"Error in analysis: {e}"
 
-def extract_audio(video_path):
-    print(f"[INFO] Extracting audio from video: {video_path}")
+def analyze_category_with_gemini(name, urdu_text, api_key, sys_instruct, deadline=None):
+    # A call still queued when a verdict-only request is decided is not sent.
+    verdict.check()
+    with span(f"gemini_{name}"):
+        return analyze_text_with_gemini(urdu_text, api_key, sys_instruct, deadline)
+
+def analyze_categories_with_gemini(urdu_text, api_key, categories, timeout=GEMINI_TIMEOUT, on_response=None):
+    """Runs one Gemini call per category concurrently; `categories` maps a name to its system prompt.
+
+    Calls that fail or miss the deadline come back as error strings, like a failed single call.
+    `on_response(name, response)` is called as each one finishes, in completion order.
+    """
+    # Retries and quota waits inside the client stop at the same deadline.
+    deadline = time.monotonic() + timeout
+    futures = {_gemini_executor.submit(in_context(analyze_category_with_gemini), name, urdu_text, api_key, sys_instruct, deadline): name
+               for name, sys_instruct in categories.items()}
+    responses = {}
+
+    def finish(name, response):
+        responses[name] = response
+        if on_response is not None:
+            on_response(name, response)
+
     try:
-        temp_audio = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        command = ["ffmpeg", "-i", video_path, "-q:a", "0", "-map", "a", temp_audio.name, "-y"]
-        os.system(' '.join(command))
-        print(f"[INFO] Audio extracted to: {temp_audio.name}")
-        return temp_audio.name
+        for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            finish(futures[future], future.result())
+            verdict.check()
+    except VerdictReached:
+        for future in futures:
+            future.cancel()
+        raise
+    except FuturesTimeoutError:
+        for future, name in futures.items():
+            if name not in responses:
+                future.cancel()
+                logger.error(f"Gemini analysis for {name} timed out after {timeout}s")
+                finish(name, f"Error in analysis: timed out after {timeout}s")
+    return {name: responses[name] for name in categories}
+
+RESULT_SCHEMA = types.Schema(
+    type=types.Type.OBJECT,
+    properties={
+        "is_flagged": types.Schema(type=types.Type.BOOLEAN),
+        "tags": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+        "reasons": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
+        "severity": types.Schema(type=types.Type.STRING),
+    },
+    required=["is_flagged", "tags", "reasons", "severity"],
+)
+
+def combined_sys_instructions(categories):
+    return Combined_Sys_Instructions + "".join(
+        f"\n# Category: {name}\n{category_instruct}" for name, category_instruct in categories.items()
+    )
+
+@span("gemini_combined")
+def analyze_combined_with_gemini(urdu_text, api_key, categories, deadline=None):
+    """Sends the transcript once for all selected categories, with a typed JSON schema for the reply.
+
+    Retries and quota waits stop at `deadline` (time.monotonic()), by default GEMINI_TIMEOUT from now.
+    """
+    logger.info(f"Sending text for combined Gemini analysis of {', '.join(categories)}...")
+    sys_instruct = combined_sys_instructions(categories)
+    schema = types.Schema(
+        type=types.Type.OBJECT,
+        properties={name: RESULT_SCHEMA for name in categories},
+        required=list(categories),
+    )
+    prompt = (
+        f"Analyze this Urdu transcript for harmful content in each category ({', '.join(categories)}): "
+        f"{urdu_text}"
+    )
+    try:
+        client = get_gemini_client(api_key)
+        response = client.generate_content(
+            model=GEMINI_MODEL,
+            config=types.GenerateContentConfig(
+                system_instruction=sys_instruct,
+                temperature=0.0,
+                response_mime_type="application/json",
+                response_schema=schema,
+            ),
+            contents=prompt,
+            deadline=deadline or time.monotonic() + GEMINI_TIMEOUT,
+        )
+        record_gemini_usage(response, "combined")
+        logger.info("Combined Gemini analysis complete.")
+        return response
     except Exception as e:
-        print(f"[ERROR] Failed to extract audio: {e}")
-        return None
+        logger.error(f"Combined Gemini analysis failed: {e}")
+        return f"Error in analysis: {e}"
 
-def analyze_video(gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious, video_path):
-    if not (detect_abusive or detect_violent or detect_nsfw or detect_political or detect_religious):
-        error_msg = "Error: At least one detection option must be selected."
-        print(f"[ERROR] {error_msg}")
-        return error_msg, [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], "", ""
+@span("gemini")
+def analyze_chunks_with_gemini(chunks, api_key, categories, mode):
+    """Sends every chunk (per category, or once for all categories) concurrently.
 
-    if not os.path.exists(video_path):
-        print(f"[ERROR] File not found: {video_path}")
-        return "Error: File not found", [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], "", ""
+    Returns one response or error string per chunk: {category: [...]} per category, or [...] combined.
+    """
+    calls = len(chunks) * (1 if mode == "combined" else len(categories))
+    # Chunks beyond the per-key concurrency cap queue behind the first wave, so give each wave its own timeout.
+    timeout = GEMINI_TIMEOUT * math.ceil(calls / GEMINI_MAX_CONCURRENCY)
+    deadline = time.monotonic() + timeout
+    if mode == "combined":
+        futures = [_gemini_executor.submit(in_context(analyze_combined_with_gemini), chunk, api_key, categories, deadline)
+                   for chunk in chunks]
+    else:
+        futures = {name: [_gemini_executor.submit(in_context(analyze_category_with_gemini), name, chunk, api_key, sys_instruct, deadline)
+                          for chunk in chunks]
+                   for name, sys_instruct in categories.items()}
+
+    def collect(future):
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            future.cancel()
+            logger.error(f"Gemini chunk analysis timed out after {timeout}s")
+            return f"Error in analysis: timed out after {timeout}s"
+
+    if mode == "combined":
+        return [collect(future) for future in futures]
+    return {name: [collect(future) for future in category_futures] for name, category_futures in futures.items()}
+
+def merge_chunk_results(parts, shared_by=None):
+    """Merges one category's per-chunk (table, data, usage) into a single (table, data) result.
+
+    Any failed chunk fails the category, since a partial merge could miss flagged content.
+    """
+    for table, data, _ in parts:
+        if data is None:
+            return table, None
+    merged = merge_results([data for _, data, _ in parts])
+    usage = SimpleNamespace(
+        prompt_token_count=sum(usage.prompt_token_count or 0 for _, _, usage in parts),
+        candidates_token_count=sum(usage.candidates_token_count or 0 for _, _, usage in parts),
+    )
+    # Each chunk is priced on its own tier, so the merged cost is the sum of the chunk costs.
+    cost = sum(calculate_cost(usage.prompt_token_count or 0, usage.candidates_token_count or 0)[0] for _, _, usage in parts)
+    return build_result_table(merged, usage, shared_by=shared_by, cost_usd=cost, chunks=len(parts)), merged
+
+def run_chunked_gemini_analysis(chunks, api_key, categories, mode):
+    logger.info(f"Transcript split into {len(chunks)} chunks for Gemini {mode} analysis")
+    responses = analyze_chunks_with_gemini(chunks, api_key, categories, mode)
+    results = {}
+    if mode == "combined":
+        parsed = [(parse_combined_response(response, categories), getattr(response, "usage_metadata", None)) for response in responses]
+        for name in categories:
+            parts = [(chunk_results[name][0], chunk_results[name][1], usage) for chunk_results, usage in parsed]
+            results[name] = merge_chunk_results(parts, shared_by=len(categories))
+    else:
+        for name, category_responses in responses.items():
+            parts = [(*parse_response_data(response), getattr(response, "usage_metadata", None)) for response in category_responses]
+            results[name] = merge_chunk_results(parts)
+    return results
+
+# Key of each category's table in the /analyze response.
+RESULT_TABLE_KEYS = {
+    "abusive": "abusive_table",
+    "violent": "violent_table",
+    "nsfw": "nsfw_audio_table",
+    "political": "political_table",
+    "religious": "religious_table",
+}
+
+def emit_table(name, result):
+    emit("table", **{RESULT_TABLE_KEYS[name]: result[0]})
+
+def run_gemini_analysis(urdu_text, api_key, categories, mode=None, segments=None):
+    """Returns {category: (table, result dict or None)} using either per-category or combined requests.
+
+    Transcripts over GEMINI_CHUNK_THRESHOLD tokens are split on the Whisper `segments` boundaries,
+    analyzed chunk by chunk in parallel and merged back into one result per category.
+    """
+    mode = validate_gemini_mode(mode)
+    start = time.monotonic()
+    chunks = split_transcript(urdu_text, segments)
+    # Results are cached on (transcript, system prompt, model) so re-runs with other video detectors skip the LLM.
+    if len(chunks) > 1:
+        cache_key = make_key("chunked", mode, urdu_text, categories, GEMINI_MODEL, GEMINI_CHUNK_TOKENS)
+        cached = gemini_cache.get(cache_key)
+        if cached is not None:
+            results = {name: tuple(result) for name, result in cached.items()}
+        else:
+            results = run_chunked_gemini_analysis(chunks, api_key, categories, mode)
+            if all(data is not None for _, data in results.values()):
+                gemini_cache.put(cache_key, results)
+    elif mode == "combined":
+        cache_key = make_key("combined", urdu_text, combined_sys_instructions(categories), GEMINI_MODEL)
+        cached = gemini_cache.get(cache_key)
+        if cached is not None:
+            results = {name: tuple(result) for name, result in cached.items()}
+        else:
+            results = parse_combined_response(analyze_combined_with_gemini(urdu_text, api_key, categories), categories)
+            if all(data is not None for _, data in results.values()):
+                gemini_cache.put(cache_key, results)
+    else:
+        results, pending, cache_keys = {}, {}, {}
+        for name, sys_instruct in categories.items():
+            cache_keys[name] = make_key("category", urdu_text, sys_instruct, GEMINI_MODEL)
+            cached = gemini_cache.get(cache_keys[name])
+            if cached is not None:
+                results[name] = tuple(cached)
+            else:
+                pending[name] = sys_instruct
+        for name, result in results.items():
+            emit_table(name, result)
+            verdict.consider_gemini(name, result[1])
+        verdict.check()
+
+        def finish(name, response):
+            results[name] = parse_response_data(response)
+            emit_table(name, results[name])
+            verdict.consider_gemini(name, results[name][1])
+            if results[name][1] is not None:
+                gemini_cache.put(cache_keys[name], results[name])
+
+        if pending:
+            analyze_categories_with_gemini(urdu_text, api_key, pending, on_response=finish)
+        results = {name: results[name] for name in categories}
+    if mode == "combined" or len(chunks) > 1:
+        # These replies cover every category at once, so their tables are all ready together.
+        for name, result in results.items():
+            emit_table(name, result)
+            verdict.consider_gemini(name, result[1])
+    logger.info(f"Gemini {mode} analysis of {len(categories)} categories took {time.monotonic() - start:.2f}s")
+    return results
+
+class NoAudioStreamError(Exception):
+    pass
+
+@span("audio_extraction")
+def extract_audio(video_path):
+    """Decodes the first audio stream straight to 16 kHz mono float32 PCM, the input Whisper expects."""
+    logger.info(f"Extracting audio from video: {video_path}")
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error", "-i", video_path,
+        "-map", "0:a:0", "-vn", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE), "-f", "f32le", "-",
+    ]
+    process = subprocess.run(command, capture_output=True)
+    if process.returncode != 0:
+        stderr = process.stderr.decode(errors="ignore").strip()
+        if "matches no streams" in stderr:
+            raise NoAudioStreamError(f"Video has no audio stream: {video_path}")
+        raise RuntimeError(f"ffmpeg failed to extract audio: {stderr}")
+    audio = np.frombuffer(process.stdout, dtype=np.float32)
+    if audio.size == 0:
+        raise NoAudioStreamError(f"Video has an empty audio stream: {video_path}")
+    logger.info(f"Extracted {audio.size / AUDIO_SAMPLE_RATE:.1f}s of audio.")
+    return audio
+
+def error_result(message):
+    return message, [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], [["N/A", ""]], "", ""
+
+def selected_categories(detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious):
+    categories = {}
+    if detect_abusive:
+        categories["abusive"] = Abusive_Content_Sys_Instructions
+    if detect_violent:
+        categories["violent"] = Violence_Sys_Instructions
+    if detect_nsfw:
+        categories["nsfw"] = NSFW_Sys_Instructions
+    if detect_political:
+        categories["political"] = Politics_Sys_Instructions
+    if detect_religious:
+        categories["religious"] = Religious_Sys_Instructions
+    return categories
+
+def transcribe_video(video_path):
+    """Transcribes the video's audio into {"text", "segments"}; raises NoAudioStreamError if it has none."""
+    audio = extract_audio(video_path)
+    asr_backend = get_asr_backend()
+    logger.info(f"Transcribing audio with {asr_backend.name}...")
+    with span("transcription"):
+        transcription = asr_backend.transcribe(audio, language="ur")
+    logger.info("Transcription complete.")
+    return transcription
+
+def nsfw_video_info(nsfw_result):
+    nsfw_decision, nsfw_stats = nsfw_result
+    return (f"{nsfw_decision}\n"
+            f"Frames evaluated: {nsfw_stats['frames_evaluated']} of {nsfw_stats['frames_sampled']}\n")
 
-    audio_file = extract_audio(video_path)
-    print("[INFO] Transcribing audio with Whisper...")
-    audio_transcript = whisper_model.transcribe(audio_file, language="ur").get("text", "")
-    print("[INFO] Transcription complete.")
+def violence_video_info(results, violence_result):
+    """Reconciles the violence model's verdict with the LLM's flag for the violent category."""
+    violence_is_flagged = None
+    violent_data = results["violent"][1]
+    if violent_data is not None:
+        violence_is_flagged = violent_data.get("is_flagged")
+
+    video_violence_info = ""
+    violence_result, violence_windows = violence_result
+    if (violence_is_flagged is not None) and (violence_is_flagged != violence_result):
+        video_violence_info += f"{'NonViolence' if violence_is_flagged==False else 'Violence'}\n"
+    else:
+        video_violence_info += f"{violence_result}\n"
+    if violence_windows:
+        flagged = [w for w in violence_windows if w["violence"] >= VIOLENCE_WINDOW_THRESHOLD]
+        video_violence_info += f"Model verdict over {len(violence_windows)} windows: {violence_result}\n"
+        for window in flagged:
+            video_violence_info += f"Violence at {window['start']:.1f}s-{window['end']:.1f}s (score: {window['violence']:.2f})\n"
+    return video_violence_info
 
+def build_video_result(flags, audio_transcript, results, video_nsfw_info="", video_violence_info=""):
+    """Assembles the 8-tuple analyze_video returns from the Gemini results and the video detector summaries."""
+    detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious = flags
     abusive_table = [["N/A", "Not analyzed"]]
     violent_table = [["N/A", "Not analyzed"]]
     nsfw_audio_table = [["N/A", "Not analyzed"]]
     political_table = [["N/A", "Not analyzed"]]
     religious_table = [["N/A", "Not analyzed"]]
-    video_nsfw_info = ""
-    video_violence_info = ""
 
     if detect_abusive:
-        print("[INFO] Analyzing abusive content...")
-        response_abusive = analyze_text_with_gemini(audio_transcript, gemini_api, Abusive_Content_Sys_Instructions)
-        abusive_table = parse_response_table(response_abusive)
+        abusive_table = results["abusive"][0]
 
-    violence_is_flagged = None
     if detect_violent:
-        print("[INFO] Analyzing violent content...")
-        response_violent = analyze_text_with_gemini(audio_transcript, gemini_api, Violence_Sys_Instructions)
-        violent_table = parse_response_table(response_violent)
-        try:
-            violence_is_flagged = json.loads(re.sub(r"^```(?:json)?\s*|```$", "", response_violent.text)).get("is_flagged")
-        except:
-            pass
+        violent_table = results["violent"][0]
 
     if detect_nsfw:
-        print("[INFO] Analyzing NSFW content...")
-        response_nsfw_audio = analyze_text_with_gemini(audio_transcript, gemini_api, NSFW_Sys_Instructions)
-        nsfw_audio_table = parse_response_table(response_nsfw_audio)
+        nsfw_audio_table = results["nsfw"][0]
 
     if detect_political:
-        print("[INFO] Analyzing political content...")
-        response_political = analyze_text_with_gemini(audio_transcript, gemini_api, Politics_Sys_Instructions)
-        political_table = parse_response_table(response_political)
+        political_table = results["political"][0]
 
     if detect_religious:
-        print("[INFO] Analyzing religious content...")
-        response_religious = analyze_text_with_gemini(audio_transcript, gemini_api, Religious_Sys_Instructions)
-        religious_table = parse_response_table(response_religious)
+        religious_table = results["religious"][0]
 
+    return (audio_transcript, abusive_table, violent_table, nsfw_audio_table,
+            political_table, religious_table, video_nsfw_info, video_violence_info)
+
+def cache_result(cache_key, result):
+    # Don't pin failed Gemini calls in the cache; the next upload should retry them.
+    if not any(table[0][0] == "Error" for table in result[1:6]):
+        analysis_cache.put(cache_key, result)
+
+def video_stage_graph(gemini_api, categories, detect_nsfw, detect_violent, video_path, gemini_mode, verdict_only=False):
+    """Builds analyze_video's stages; returns (graph, outputs).
+
+    For a verdict-only run NSFW uses early exit and the per-video summaries are left out.
+    """
+    # Video detectors start on the upload right away, alongside audio extraction and ASR; the LLM
+    # starts once the transcript exists, and the violence verdict waits for both of its inputs.
+    graph = StageGraph()
+    graph.add("transcription", lambda: transcribe_video(video_path))
+    graph.add("gemini", lambda transcription: run_gemini_analysis(
+        transcription["text"], gemini_api, categories, gemini_mode, transcription["segments"]), deps=["transcription"])
+    outputs = ["transcription", "gemini"]
     if detect_nsfw or detect_violent:
-        print("[INFO] Running video content detection...")
-        violence_detector_model_path = './violence/code/runs/20250305_175848/video_classifier_epoch_2.pth'
-        nsfw_result, violence_result = run_detection_models(video_path, violence_detector_model_path, detect_nsfw, detect_violent)
-        if detect_nsfw:
-            video_nsfw_info += f"{nsfw_result}\n"
-        if detect_violent:
-            if (violence_is_flagged is not None) and (violence_is_flagged != violence_result):
-                video_violence_info += f"{'NonViolence' if violence_is_flagged==False else 'Violence'}\n"
-            else:
-                video_violence_info += f"{violence_result}\n"
+        # One decode feeds both detectors, frame by frame; with a detector pool it runs in a worker.
+        # The classifier stays resident in the model registry; passing the current checkpoint lets
+        # pool workers follow a hot reload in this process.
+        nsfw_options = ({"early_exit": True} if verdict_only else {}) if detect_nsfw else None
+        violence_options = {"model_path": current_violence_model_path()} if detect_violent else None
+        graph.add("frames", lambda: detector_pool.detect(video_path, nsfw=nsfw_options, violence=violence_options))
+    if detect_nsfw:
+        graph.add("nsfw", lambda scan: scan["nsfw"], deps=["frames"])
+        if not verdict_only:
+            graph.add("nsfw_info", nsfw_video_info, deps=["nsfw"])
+            outputs.append("nsfw_info")
+    if detect_violent:
+        graph.add("violence", lambda scan: scan["violence"], deps=["frames"])
+        if not verdict_only:
+            graph.add("violence_info", violence_video_info, deps=["gemini", "violence"])
+            outputs.append("violence_info")
+    return graph, outputs
+
+@span("analyze_video")
+def analyze_video(gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious, video_path, gemini_mode=None, video_hash=None):
+    if not (detect_abusive or detect_violent or detect_nsfw or detect_political or detect_religious):
+        error_msg = "Error: At least one detection option must be selected."
+        logger.error(f"{error_msg}")
+        return error_result(error_msg)
+
+    if not os.path.exists(video_path):
+        logger.error(f"File not found: {video_path}")
+        return error_result("Error: File not found")
 
-    print("[INFO] Cleaning up temporary files...")
-    os.remove(audio_file)
+    gemini_mode = validate_gemini_mode(gemini_mode)
+    flags = [detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious]
+    cache_key = make_key(video_hash or hash_file(video_path), flags, gemini_mode, model_versions())
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        os.remove(video_path)
+        return tuple(cached)
+
+    categories = selected_categories(*flags)
+    logger.info(f"Analyzing {', '.join(categories)} content...")
+    graph, outputs = video_stage_graph(gemini_api, categories, detect_nsfw, detect_violent, video_path, gemini_mode)
+
+    def stage_done(name, result):
+        # Partial results for a streaming request, as soon as each is known.
+        if name == "transcription":
+            emit("transcript", transcript=result["text"])
+        elif name in ("nsfw_info", "violence_info"):
+            emit(f"video_{name}", **{f"video_{name}": result})
+        emit("progress", stage=name, status="done")
+
+    try:
+        stages = graph.run(outputs, on_done=stage_done)
+    except NoAudioStreamError as e:
+        logger.error(f"{e}")
+        os.remove(video_path)
+        return error_result(f"Error: {e}")
+
+    logger.info("Cleaning up temporary files...")
     os.remove(video_path)
-    print("[INFO] Analysis complete.")
+    logger.info("Analysis complete.")
 
-    return (audio_transcript, abusive_table, violent_table, nsfw_audio_table,
-            political_table, religious_table, video_nsfw_info, video_violence_info)
+    result = build_video_result(flags, stages["transcription"]["text"], stages["gemini"],
+                                stages.get("nsfw_info", ""), stages.get("violence_info", ""))
+    cache_result(cache_key, result)
+    return result
+
+@span("analyze_verdict")
+def analyze_video_verdict(gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious, video_path, gemini_mode=None):
+    """Verdict-only analysis: returns {"verdict": "block" or "allow", "stage", "reason"}.
+
+    The first decisive flag (see verdict.py) stops every other stage: queued Gemini calls are
+    dropped and frame decoding and inference stop at their next batch. The verdict is returned at
+    once; the upload is removed after the remaining stages have stopped.
+    """
+    flags = [detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious]
+    if not any(flags):
+        return {"error": "Error: At least one detection option must be selected."}
+    if not os.path.exists(video_path):
+        logger.error(f"File not found: {video_path}")
+        return {"error": "Error: File not found"}
+
+    categories = selected_categories(*flags)
+    logger.info(f"Verdict-only analysis of {', '.join(categories)} content...")
+    graph, _ = video_stage_graph(gemini_api, categories, detect_nsfw, detect_violent, video_path,
+                                 validate_gemini_mode(gemini_mode), verdict_only=True)
+
+    def stage_done(name, result):
+        if name == "nsfw":
+            verdict.consider_nsfw(result)
+        elif name == "violence":
+            verdict.consider_violence(result)
+        emit("progress", stage=name, status="done")
+
+    def cleanup():
+        # Stages still running after the verdict read the upload, so it goes only once the graph
+        # reports every stage stopped.
+        os.remove(video_path)
 
-def parse_response_table(response):
-    if isinstance(response, str):
-        print(f"[WARNING] Response is an error string: {response}")
-        return [["Error", response]]
     try:
-        token_usage = response.usage_metadata
+        with verdict_scope() as decision:
+            graph.run([], on_done=stage_done, cancel=decision.reached, cleanup=cleanup)
+    except NoAudioStreamError as e:
+        logger.error(f"{e}")
+        return {"error": f"Error: {e}"}
+    logger.info(f"Verdict: {decision.as_dict()}")
+    return decision.as_dict()
+
+def batch_stage_graph(gemini_api, categories, detect_nsfw, detect_violent, video_paths, gemini_mode):
+    """Builds analyze_videos' stages for {index: video path}.
+
+    "transcription_<i>" stages run one at a time in order and yield a NoAudioStreamError instead of
+    raising it, so one silent video doesn't fail the batch; "gemini_<i>" starts on its transcript
+    and "video" (index -> scan_video-style result) runs alongside both.
+    """
+    graph = StageGraph()
+
+    def transcribe(video_path):
+        try:
+            return transcribe_video(video_path)
+        except NoAudioStreamError as e:
+            logger.error(f"{e}")
+            return e
+
+    def gemini(transcription):
+        if isinstance(transcription, NoAudioStreamError):
+            return None
+        return run_gemini_analysis(transcription["text"], gemini_api, categories, gemini_mode, transcription["segments"])
+
+    previous = []
+    for i, video_path in video_paths.items():
+        # ASR holds one model, so each transcription waits for the one before it.
+        graph.add(f"transcription_{i}", lambda *_, video_path=video_path: transcribe(video_path), deps=previous)
+        graph.add(f"gemini_{i}", gemini, deps=[f"transcription_{i}"])
+        previous = [f"transcription_{i}"]
+    if detect_nsfw or detect_violent:
+        def scan():
+            logger.info(f"Running video content detection on {len(video_paths)} videos...")
+            scans = video_scan.scan_videos(
+                list(video_paths.values()),
+                nsfw={} if detect_nsfw else None,
+                violence={"model_path": current_violence_model_path()} if detect_violent else None,
+            )
+            return dict(zip(video_paths, scans))
+        graph.add("video", scan)
+    return graph
+
+@span("analyze_batch")
+def analyze_videos(gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious, video_paths, gemini_mode=None, video_hashes=None, remove_files=True):
+    """Analyzes several videos together and returns one analyze_video-style tuple per path, in order.
+
+    Videos are transcribed one after another, and each transcript's Gemini calls start as soon as
+    it exists. Meanwhile the video models run alongside ASR: frames of all videos share the NSFW
+    micro-batches and violence clips share forward passes, with one video decoded at a time.
+    """
+    flags = [detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious]
+    if not any(flags):
+        error_msg = "Error: At least one detection option must be selected."
+        logger.error(f"{error_msg}")
+        return [error_result(error_msg) for _ in video_paths]
+
+    gemini_mode = validate_gemini_mode(gemini_mode)
+    video_hashes = video_hashes or [None] * len(video_paths)
+    categories = selected_categories(*flags)
+    results = [None] * len(video_paths)
+    pending = {}  # index -> cache key
+
+    for i, video_path in enumerate(video_paths):
+        if not os.path.exists(video_path):
+            logger.error(f"File not found: {video_path}")
+            results[i] = error_result("Error: File not found")
+            continue
+        cache_key = make_key(video_hashes[i] or hash_file(video_path), flags, gemini_mode, model_versions())
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            results[i] = tuple(cached)
+            continue
+        pending[i] = cache_key
+
+    logger.info(f"Batch: {len(pending)} of {len(video_paths)} videos need analysis.")
+    if pending:
+        stages = batch_stage_graph(gemini_api, categories, detect_nsfw, detect_violent,
+                                   {i: video_paths[i] for i in pending}, gemini_mode).run()
+        for i, cache_key in pending.items():
+            transcription = stages[f"transcription_{i}"]
+            if isinstance(transcription, NoAudioStreamError):
+                results[i] = error_result(f"Error: {transcription}")
+                continue
+            gemini_results = stages[f"gemini_{i}"]
+            scan = stages.get("video", {}).get(i)
+            results[i] = build_video_result(
+                flags, transcription["text"], gemini_results,
+                nsfw_video_info(scan["nsfw"]) if detect_nsfw else "",
+                violence_video_info(gemini_results, scan["violence"]) if detect_violent else "",
+            )
+            cache_result(cache_key, results[i])
+
+    if remove_files:
+        for video_path in video_paths:
+            if os.path.exists(video_path):
+                os.remove(video_path)
+    logger.info("Batch analysis complete.")
+    return results
+
+def build_result_table(data, token_usage, shared_by=None, cost_usd=None, chunks=None):
+    """Flattens one category's result dict into the [field, value] rows the frontend renders."""
+    if cost_usd is None:
         cost_usd, cost_pkr = calculate_cost(token_usage.prompt_token_count, token_usage.candidates_token_count)
+    else:
+        cost_usd, cost_pkr = round(cost_usd, 8), round(cost_usd, 8) * 280.0
+    data = dict(data)
+    data["LLM Cost Breakdown"] = {
+        "input_tokens": token_usage.prompt_token_count,
+        "output_tokens": token_usage.candidates_token_count,
+        "cost_usd": cost_usd,
+        "cost_pkr": cost_pkr
+    }
+    if shared_by:
+        # Combined mode: these totals cover one request shared by every selected category.
+        data["LLM Cost Breakdown"]["shared_by_categories"] = shared_by
+    if chunks:
+        # Long transcripts: these totals add up every chunk's request.
+        data["LLM Cost Breakdown"]["transcript_chunks"] = chunks
+    table = []
+    for key, value in data.items():
+        if isinstance(value, dict):
+            sub_val = "\n".join([f"{k}: {v}" for k, v in value.items()])
+            table.append([key, sub_val])
+        elif isinstance(value, list):
+            table.append([key, "\n".join(map(str, value))])
+        else:
+            table.append([key, str(value)])
+    return table
+
+def parse_response_data(response):
+    if isinstance(response, str):
+        logger.warning(f"Response is an error string: {response}")
+        return [["Error", response]], None
+    try:
         cleaned = re.sub(r"^```(?:json)?\s*|```$", "", response.text, flags=re.MULTILINE).strip()
         data = json.loads(cleaned)
-        data["LLM Cost Breakdown"] = {
-            "input_tokens": token_usage.prompt_token_count,
-            "output_tokens": token_usage.candidates_token_count,
-            "cost_usd": cost_usd,
-            "cost_pkr": cost_pkr
-        }
-        table = []
-        for key, value in data.items():
-            if isinstance(value, dict):
-                sub_val = "\n".join([f"{k}: {v}" for k, v in value.items()])
-                table.append([key, sub_val])
-            elif isinstance(value, list):
-                table.append([key, "\n".join(map(str, value))])
-            else:
-                table.append([key, str(value)])
-        return table
+        return build_result_table(data, response.usage_metadata), data
+    except Exception as e:
+        logger.error(f"Failed to parse Gemini response: {e}")
+        return [["Error", f"Parsing error: {e}"]], None
+
+def parse_response_table(response):
+    return parse_response_data(response)[0]
+
+def parse_combined_response(response, categories):
+    if isinstance(response, str):
+        logger.warning(f"Response is an error string: {response}")
+        return {name: ([["Error", response]], None) for name in categories}
+    try:
+        # The response schema guarantees plain JSON, so no code-fence stripping is needed.
+        data = json.loads(response.text)
     except Exception as e:
-        print(f"[ERROR] Failed to parse Gemini response: {e}")
-        return [["Error", f"Parsing error: {e}"]]
\ No newline at end of file
+        logger.error(f"Failed to parse combined Gemini response: {e}")
+        return {name: ([["Error", f"Parsing error: {e}"]], None) for name in categories}
+    results = {}
+    for name in categories:
+        if name not in data:
+            results[name] = ([["Error", f"Parsing error: missing category {name}"]], None)
+            continue
+        results[name] = (build_result_table(data[name], response.usage_metadata, shared_by=len(categories)), data[name])
+    return results
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+ASR_BACKEND = os.environ.get("ASR_BACKEND", "whisper")
+ASR_MODEL_SIZE = os.environ.get("ASR_MODEL_SIZE", "medium")
+# Audio longer than this is split into chunks transcribed in parallel, on backends that allow it with ASR_WORKERS > 1.
+ASR_CHUNK_SECONDS = float(os.environ.get("ASR_CHUNK_SECONDS", 120))
+ASR_WORKERS = int(os.environ.get("ASR_WORKERS", max(1, (os.cpu_count() or 1) // 4)))
+SAMPLE_RATE = 16000
+
+def split_audio(audio, chunk_seconds=ASR_CHUNK_SECONDS, search_seconds=1.0, sample_rate=SAMPLE_RATE):
+    """Splits audio into ~chunk_seconds pieces, cutting at the quietest 20 ms window near each boundary.
+
+    Returns (start_sample, chunk) pairs so segment timestamps can be shifted back onto the full audio.
+    """
+    chunk_samples = int(chunk_seconds * sample_rate)
+    if len(audio) <= chunk_samples:
+        return [(0, audio)]
+    window = int(0.02 * sample_rate)
+    search = int(search_seconds * sample_rate)
+    chunks, start = [], 0
+    while len(audio) - start > chunk_samples:
+        target = start + chunk_samples
+        lo, hi = max(start + window, target - search), min(len(audio) - window, target + search)
+        energies = [np.abs(audio[i:i + window]).mean() for i in range(lo, hi, window)]
+        cut = lo + int(np.argmin(energies)) * window if energies else target
+        chunks.append((start, audio[start:cut]))
+        start = cut
+    chunks.append((start, audio[start:]))
+    return chunks
+
+class ASRBackend:
+    """Interface for speech recognition engines used by analyze_video."""
+    name = "base"
+    # Whether one loaded model may transcribe several chunks from different threads at once.
+    parallel_chunks = False
+
+    def __init__(self, model_size=ASR_MODEL_SIZE):
+        self.model_size = model_size
+        self._stats_lock = threading.Lock()
+        self._audio_seconds = 0.0
+        self._wall_seconds = 0.0
+        self._calls = 0
+
+    def transcribe_chunk(self, audio, language):
+        """Returns {"text": str, "segments": [{"start", "end", "text"}]} for one chunk of 16 kHz float32 audio."""
+        raise NotImplementedError
+
+    def transcribe(self, audio, language="ur"):
+        start = time.monotonic()
+        # Chunking only pays off in parallel; run sequentially, it just adds boundary artifacts.
+        workers = ASR_WORKERS if self.parallel_chunks else 1
+        chunks = split_audio(audio) if workers > 1 else [(0, audio)]
+        workers = min(workers, len(chunks))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda chunk: self.transcribe_chunk(chunk[1], language), chunks))
+        else:
+            results = [self.transcribe_chunk(chunk, language) for _, chunk in chunks]
+
+        segments = []
+        for (offset, _), result in zip(chunks, results):
+            for segment in result["segments"]:
+                segments.append({
+                    "start": segment["start"] + offset / SAMPLE_RATE,
+                    "end": segment["end"] + offset / SAMPLE_RATE,
+                    "text": segment["text"],
+                })
+        text = " ".join(result["text"].strip() for result in results if result["text"].strip())
+
+        elapsed = time.monotonic() - start
+        audio_seconds = len(audio) / SAMPLE_RATE
+        with self._stats_lock:
+            self._audio_seconds += audio_seconds
+            self._wall_seconds += elapsed
+            self._calls += 1
+        logger.info(f"{self.name} ({self.model_size}) transcribed {audio_seconds:.1f}s of audio in {elapsed:.2f}s "
+                    f"({len(chunks)} chunks, {workers} workers, {audio_seconds / max(elapsed, 1e-6):.1f}x realtime)")
+        return {"text": text, "segments": segments}
+
+    def stats(self):
+        """Cumulative throughput of this backend since it was loaded."""
+        with self._stats_lock:
+            return {
+                "backend": self.name,
+                "model_size": self.model_size,
+                "calls": self._calls,
+                "audio_seconds": round(self._audio_seconds, 2),
+                "wall_seconds": round(self._wall_seconds, 2),
+                "realtime_factor": round(self._audio_seconds / self._wall_seconds, 2) if self._wall_seconds else None,
+            }
+
+class WhisperBackend(ASRBackend):
+    """Reference openai-whisper engine, fp32 on CPU or fp16 on CUDA."""
+    name = "whisper"
+    # Whisper's decoder installs kv-cache hooks on the shared model, so chunks run one at a time.
+    parallel_chunks = False
+
+    def __init__(self, model_size=ASR_MODEL_SIZE):
+        super().__init__(model_size)
+        import whisper
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        logger.info(f"Loading Whisper {model_size} on {self.device}...")
+        self.model = whisper.load_model(model_size, device=self.device)
+        logger.info("Whisper model loaded successfully.")
+
+    def transcribe_chunk(self, audio, language):
+        result = self.model.transcribe(audio, language=language, fp16=self.device.type == "cuda")
+        return {
+            "text": result.get("text", ""),
+            "segments": [{"start": s["start"], "end": s["end"], "text": s["text"]} for s in result.get("segments", [])],
+        }
+
+class FasterWhisperBackend(ASRBackend):
+    """CTranslate2 engine (faster-whisper), int8-quantized on CPU."""
+    name = "faster-whisper"
+    parallel_chunks = True
+
+    def __init__(self, model_size=ASR_MODEL_SIZE, compute_type=None):
+        super().__init__(model_size)
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise ImportError("ASR_BACKEND=faster-whisper requires the faster-whisper package") from e
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        compute_type = compute_type or os.environ.get("ASR_COMPUTE_TYPE", "float16" if device == "cuda" else "int8")
+        logger.info(f"Loading faster-whisper {model_size} on {device} ({compute_type})...")
+        # Split the cores between the parallel chunk workers instead of oversubscribing them.
+        cpu_threads = max(1, (os.cpu_count() or 1) // ASR_WORKERS)
+        self.model = WhisperModel(model_size, device=device, compute_type=compute_type,
+                                  cpu_threads=cpu_threads, num_workers=ASR_WORKERS)
+        logger.info("faster-whisper model loaded successfully.")
+
+    def transcribe_chunk(self, audio, language):
+        segments, _ = self.model.transcribe(audio, language=language)
+        segments = [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+        return {"text": "".join(s["text"] for s in segments), "segments": segments}
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+def load_backend(name=ASR_BACKEND, model_size=ASR_MODEL_SIZE):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown ASR backend '{name}'; choose from {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_size)
+
+def get_backend():
+    """Returns the configured backend, loading it on first use."""
+    return registry.get("asr", lambda _: load_backend(), f"{ASR_BACKEND}:{ASR_MODEL_SIZE}")
@@ -0,0 +1,191 @@
+"""Per-stage benchmark of the analyze_video pipeline over the bundled sample reels.
+
+    python benchmark.py [dirs...] [--repeat N] [--output report.json]
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json [--tolerance 0.2]
+
+Gemini is served by the fake backend in gemini_client, so runs need no API key and measure only our side of the
+call. Models are loaded before timing starts; load times are reported separately.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import numpy as np
+import psutil
+import torch
+import analysis
+import nsfw_detector
+import violence_detector
+from frame_decoder import decode_frames
+from gemini_client import GeminiClient, FakeGeminiBackend, register_client
+
+logger = logging.getLogger(__name__)
+
+STUB_API_KEY = "benchmark-stub"
+# Simulated Gemini round trip; 0 times only prompt building and response parsing.
+BENCHMARK_GEMINI_LATENCY = float(os.environ.get("BENCHMARK_GEMINI_LATENCY", 0))
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mov", ".mkv", ".avi")
+STAGE_KEYS = ("p50_ms", "p90_ms", "p99_ms")
+
+class PeakMemory:
+    """Samples the process RSS in the background while a stage runs and records the peak."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_rss = self.process.memory_info().rss
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+        self.peak_cuda = torch.cuda.max_memory_allocated() if torch.cuda.is_available() else None
+
+class StageTimer:
+    def __init__(self):
+        self.runs = {}
+
+    def time(self, stage, fn, *args, count=None, **kwargs):
+        """Runs `fn` as one sample of `stage`; `count` is its frame count, or a function of its result."""
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+        self.runs.setdefault(stage, []).append({
+            "seconds": elapsed,
+            "frames": count(result) if callable(count) else count,
+            "peak_rss": memory.peak_rss,
+            "peak_cuda": memory.peak_cuda,
+        })
+        return result
+
+    def report(self):
+        stages = {}
+        for stage, runs in self.runs.items():
+            seconds = np.array([run["seconds"] for run in runs])
+            frames = sum(run["frames"] or 0 for run in runs)
+            peak_cuda = [run["peak_cuda"] for run in runs if run["peak_cuda"] is not None]
+            stages[stage] = {
+                "runs": len(runs),
+                "mean_ms": round(float(seconds.mean()) * 1000, 2),
+                **{key: round(float(np.percentile(seconds, q)) * 1000, 2) for key, q in zip(STAGE_KEYS, (50, 90, 99))},
+                "fps": round(frames / float(seconds.sum()), 2) if frames and seconds.sum() else None,
+                "peak_rss_mb": round(max(run["peak_rss"] for run in runs) / 2**20, 1),
+                "peak_cuda_mb": round(max(peak_cuda) / 2**20, 1) if peak_cuda else None,
+            }
+        return stages
+
+def list_videos(video_dirs):
+    return [os.path.join(video_dir, name) for video_dir in video_dirs
+            for name in sorted(os.listdir(video_dir)) if name.lower().endswith(VIDEO_EXTENSIONS)]
+
+def nsfw_pass(forward, frames):
+    for _, batch, base in nsfw_detector.iter_batches(frames):
+        forward(base, batch)
+
+def benchmark_video(timer, video_path, categories):
+    try:
+        audio = timer.time("audio_extraction", analysis.extract_audio, video_path)
+    except analysis.NoAudioStreamError:
+        logger.warning(f"Skipping audio stages, no audio stream: {video_path}")
+    else:
+        transcript = timer.time("transcription", analysis.get_asr_backend().transcribe, audio, language="ur")["text"]
+        for name, sys_instruct in categories.items():
+            response = timer.time(f"gemini_{name}", analysis.analyze_text_with_gemini, transcript, STUB_API_KEY, sys_instruct)
+            analysis.parse_response_data(response)
+
+    frames, fps = timer.time("frame_extraction", decode_frames, video_path, nsfw_detector.frame_size(),
+                             count=lambda decoded: len(decoded[0]))
+    sampled = nsfw_detector.sample_frames(frames)
+    timer.time("nsfw_vit", nsfw_pass, nsfw_detector.vit_forward, sampled, count=len(sampled))
+    timer.time("nsfw_pipeline", nsfw_pass, nsfw_detector.pipeline_forward, sampled, count=len(sampled))
+    timer.time("violence", violence_detector.main, frames=frames, fps=fps)
+
+def run(video_dirs, repeat=1):
+    # Serve the stub key from the fake backend so the real client, prompt and parsing path is exercised.
+    register_client(STUB_API_KEY, GeminiClient(FakeGeminiBackend(latency=BENCHMARK_GEMINI_LATENCY, error_rate=0.0)))
+    # Every Gemini category is timed; the detectors' own env configuration applies to the video stages.
+    categories = analysis.selected_categories(True, True, True, True, True)
+
+    load_times = {}
+    for name in analysis.models_for_detectors("all"):
+        start = time.perf_counter()
+        analysis.MODEL_LOADERS[name]()
+        load_times[name] = round(time.perf_counter() - start, 2)
+
+    videos = list_videos(video_dirs)
+    timer = StageTimer()
+    for _ in range(repeat):
+        for video_path in videos:
+            logger.info(f"Benchmarking {video_path}")
+            benchmark_video(timer, video_path, categories)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "device": str(analysis.device),
+        "videos": len(videos),
+        "repeat": repeat,
+        "model_versions": analysis.model_versions(),
+        "model_load_seconds": load_times,
+        "stages": timer.report(),
+    }
+
+def compare(report, baseline, tolerance):
+    """Stages whose latency percentiles grew by more than `tolerance` over the baseline."""
+    regressions = []
+    for stage, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if previous is None:
+            continue
+        for key in STAGE_KEYS:
+            if previous[key] and current[key] > previous[key] * (1 + tolerance):
+                regressions.append({"stage": stage, "metric": key, "baseline": previous[key], "current": current[key],
+                                    "change": round(current[key] / previous[key] - 1, 3)})
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage benchmark over the sample reels.")
+    parser.add_argument("dirs", nargs="*", default=["Sample_Test_Reels", "All Sample VIdeos"])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="compare against this report and exit non-zero on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional latency increase")
+    parser.add_argument("--save-baseline", help="write the report as the new baseline")
+    args = parser.parse_args()
+
+    report = run(args.dirs, args.repeat)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(encoded)
+    else:
+        print(encoded)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            f.write(encoded)
+    if report.get("regressions"):
+        for regression in report["regressions"]:
+            print(f"[REGRESSION] {regression['stage']} {regression['metric']}: "
+                  f"{regression['baseline']}ms -> {regression['current']}ms", file=sys.stderr)
+        sys.exit(1)
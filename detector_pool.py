@@ -0,0 +1,157 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from telemetry import span
+import verdict
+import video_scan
+
+logger = logging.getLogger(__name__)
+
+# Worker processes that run the frame detectors; 0 runs them on threads in the web process.
+DETECTOR_WORKERS = int(os.environ.get("DETECTOR_WORKERS", 0))
+# Torch intra-op threads per worker; by default the cores are split evenly between the workers.
+DETECTOR_WORKER_THREADS = int(os.environ.get("DETECTOR_WORKER_THREADS", 0)) or max(1, (os.cpu_count() or 1) // max(1, DETECTOR_WORKERS))
+
+class CancelFlag:
+    """A one-byte shared-memory flag a worker polls at each verdict check (see `cancel`)."""
+
+    def __init__(self):
+        self._shm = shared_memory.SharedMemory(create=True, size=1)
+        self._shm.buf[0] = 0
+        self.name = self._shm.name
+
+    def cancel(self):
+        """Makes the worker still scanning for this request stop at its next verdict check."""
+        if self._shm is not None:
+            self._shm.buf[0] = 1
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the segment with the resource tracker, which would
+        # unlink it when this worker exits; the web process owns it, so unregister here.
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def _init_worker(threads):
+    os.environ["OMP_NUM_THREADS"] = os.environ["MKL_NUM_THREADS"] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed by earlier torch work in this process
+    import cv2
+    cv2.setNumThreads(1)
+    from nsfw_detector import load_models as load_nsfw_models
+    from violence_detector import get_model as load_violence_model
+    load_nsfw_models()
+    load_violence_model()
+    logger.info(f"Detector worker {os.getpid()} ready with {threads} threads")
+
+class _CancelFlag:
+    """The worker's view of a CancelFlag, standing in for Verdict.reached."""
+
+    def __init__(self, shm, offset):
+        self._shm, self._offset = shm, offset
+
+    def is_set(self):
+        return self._shm.buf[self._offset] != 0
+
+    def set(self):
+        self._shm.buf[self._offset] = 1
+
+def _without_tracebacks(error):
+    chained = error
+    while chained is not None:
+        chained.__traceback__ = None
+        chained = chained.__cause__ or chained.__context__
+    return error
+
+def _run_in_worker(video_path, nsfw, violence, flag_name):
+    shm = _attach(flag_name)
+    error = None
+    try:
+        # verdict.check() calls in the detectors read the flag, so a cancelled scan stops at its next batch.
+        with verdict.verdict_scope(_CancelFlag(shm, 0)):
+            return video_scan.scan_video(video_path, nsfw, violence)
+    except Exception as e:
+        if not isinstance(e, verdict.VerdictReached):
+            logger.exception(f"Detector scan of {video_path} failed")
+        # The traceback's stack frames can hold views of shm.buf, and close() raises BufferError
+        # while any exist, which would replace this error. The parent only gets the pickled error anyway.
+        error = _without_tracebacks(e)
+    finally:
+        shm.close()
+    raise error
+
+def _ping():
+    return os.getpid()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def enabled():
+    return DETECTOR_WORKERS > 0
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that already holds torch threads (and possibly CUDA) is unsafe.
+            _pool = ProcessPoolExecutor(
+                max_workers=DETECTOR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(DETECTOR_WORKER_THREADS,),
+            )
+            logger.info(f"Started detector pool with {DETECTOR_WORKERS} workers x {DETECTOR_WORKER_THREADS} threads")
+        return _pool
+
+def start():
+    """Spawns every worker and waits until each has its models loaded."""
+    pool = get_pool()
+    return sorted({future.result() for future in [pool.submit(_ping) for _ in range(DETECTOR_WORKERS)]})
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+def detect(video_path, nsfw=None, violence=None):
+    """Runs video_scan.scan_video on the upload, in a worker process when the pool is enabled.
+
+    Workers decode the video from `video_path` themselves, so no frames cross the process
+    boundary. `nsfw` and `violence` are the detectors' main() options, None to skip one.
+    """
+    if not enabled():
+        return video_scan.scan_video(video_path, nsfw, violence)
+    flag = CancelFlag()
+    # A verdict decided elsewhere while the worker runs raises the flag it polls.
+    verdict.on_reached(flag.cancel)
+    global _pool
+    try:
+        with span("detector_worker"):
+            return get_pool().submit(_run_in_worker, video_path, nsfw, violence, flag.name).result()
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool for the next request.
+        with _pool_lock:
+            _pool = None
+        raise
+    finally:
+        flag.close()
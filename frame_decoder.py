@@ -0,0 +1,98 @@
+import logging
+import math
+import cv2
+import numpy as np
+from telemetry import span, emit
+import verdict
+
+logger = logging.getLogger(__name__)
+
+# Default decode size, the violence classifier's input. NSFW decodes at its larger model's input
+# instead (nsfw_detector.frame_size, 384x384 for the ViT detector) so no model upscales frames.
+FRAME_SIZE = (224, 224)
+# Frames decoded between progress events (and verdict checks) on a streaming or verdict-only request.
+PROGRESS_EVERY = 100
+# Most frames decode_frames allocates up front; container frame counts can be missing or made up,
+# so a longer video grows the buffer as it goes instead.
+DECODE_PREALLOC_FRAMES = 1800
+
+def frame_count(cap):
+    """The container's frame count, or None when it is missing or implausible (webm/mkv often report 0)."""
+    count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    if not math.isfinite(count) or count < 1 or count > 1e8:
+        return None
+    return int(count)
+
+def to_rgb(frame, output_size=FRAME_SIZE):
+    """Resizes a decoded BGR frame to output_size (width, height) and converts it to RGB uint8."""
+    frame = cv2.resize(frame, output_size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+def video_fps(video_path):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return cap.get(cv2.CAP_PROP_FPS) or 30.0
+    finally:
+        cap.release()
+
+def iter_frames(video_path):
+    """Decodes a video one frame at a time, yielding (index, BGR frame at native size).
+
+    Only the current frame is held here; callers resize and keep what they need with `to_rgb`.
+    """
+    logger.info(f"Decoding frames from video: {video_path}")
+    cap = cv2.VideoCapture(video_path)
+    total = frame_count(cap)
+    count = 0
+    try:
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield count, frame
+            count += 1
+            if count % PROGRESS_EVERY == 0:
+                verdict.check()
+                emit("progress", stage="frames", done=count, total=total)
+    finally:
+        cap.release()
+    logger.info(f"Total frames decoded: {count}")
+    emit("progress", stage="frames", done=count, total=count)
+
+def stream_frames(video_path, output_size=FRAME_SIZE):
+    """Yields (index, RGB uint8 frame resized to output_size) for every frame, one at a time."""
+    for index, frame in iter_frames(video_path):
+        yield index, to_rgb(frame, output_size)
+
+@span("frame_decode")
+def decode_frames(video_path, output_size=FRAME_SIZE):
+    """Decodes every frame of a video once into an in-memory (N, H, W, 3) RGB uint8 array.
+
+    For tools that need the whole video at once (benchmarks, parity checks); analysis streams
+    frames with `iter_frames` instead. Frames are written in place into one buffer, which grows
+    when the video has more frames than were allocated up front.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    capacity = min(frame_count(cap) or 256, DECODE_PREALLOC_FRAMES)
+    cap.release()
+    width, height = output_size
+    frames = np.empty((capacity, height, width, 3), dtype=np.uint8)
+    count = 0
+    for index, frame in iter_frames(video_path):
+        if index == len(frames):
+            grown = np.empty((len(frames) + len(frames) // 2 + 1, height, width, 3), dtype=np.uint8)
+            grown[:index] = frames
+            frames = grown
+        frames[index] = to_rgb(frame, output_size)
+        count = index + 1
+    return frames[:count], fps
+
+def perceptual_hash(frame, hash_size=8):
+    """64-bit difference hash (dHash) of an RGB frame; near-duplicate frames differ in only a few bits."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+def hash_distance(hash_a, hash_b):
+    return int(np.unpackbits(hash_a ^ hash_b).sum())
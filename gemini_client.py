@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from telemetry import Counter
+
+logger = logging.getLogger(__name__)
+
+# "google" calls the Gemini API; "fake" answers locally, for offline load tests.
+GEMINI_BACKEND = os.environ.get("GEMINI_BACKEND", "google")
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", 60))
+# Per-key quotas; the defaults sit under the paid-tier limits of gemini-1.5-flash.
+GEMINI_RPM = float(os.environ.get("GEMINI_RPM", 1000))
+GEMINI_TPM = float(os.environ.get("GEMINI_TPM", 2_000_000))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 8))
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", 4))
+GEMINI_BACKOFF_BASE = float(os.environ.get("GEMINI_BACKOFF_BASE", 1.0))
+GEMINI_BACKOFF_MAX = float(os.environ.get("GEMINI_BACKOFF_MAX", 30.0))
+# Spend limit per key over a rolling window, in USD; 0 disables the check.
+GEMINI_BUDGET_USD = float(os.environ.get("GEMINI_BUDGET_USD", 0))
+GEMINI_BUDGET_WINDOW = float(os.environ.get("GEMINI_BUDGET_WINDOW", 24 * 3600))
+# Output tokens assumed when estimating a call's cost before it is made.
+GEMINI_OUTPUT_TOKEN_ESTIMATE = int(os.environ.get("GEMINI_OUTPUT_TOKEN_ESTIMATE", 512))
+GEMINI_FAKE_LATENCY = float(os.environ.get("GEMINI_FAKE_LATENCY", 0.5))
+GEMINI_FAKE_ERROR_RATE = float(os.environ.get("GEMINI_FAKE_ERROR_RATE", 0.0))
+
+# Quota, overload and transient server errors; anything else fails the call at once.
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+GEMINI_RETRIES = Counter("moderation_gemini_retries_total", "Gemini calls retried after a retryable error.")
+GEMINI_REJECTED = Counter("moderation_gemini_rejected_total", "Gemini calls refused before sending, by reason.")
+
+class GeminiBudgetExceededError(Exception):
+    pass
+
+class GeminiDeadlineError(Exception):
+    pass
+
+def calculate_cost(input_tokens, output_tokens):
+    input_price = 0.075 if input_tokens <= 128000 else 0.15
+    output_price = 0.30 if output_tokens <= 128000 else 0.60
+    cost = ((input_tokens / 1_000_000.0) * input_price) + ((output_tokens / 1_000_000.0) * output_price)
+    return round(cost, 8), round(cost, 8) * 280.0
+
+def estimate_tokens(text):
+    # Urdu runs at roughly three characters per token; erring high keeps the budget check conservative.
+    return len(text) // 3 + 1
+
+def is_retryable(error):
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code in RETRYABLE_CODES:
+        return True
+    # Timeouts and dropped connections from the HTTP layer carry no status code.
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "TimeoutException", "ConnectError", "ReadError", "RemoteProtocolError")
+
+def backoff_delay(attempt, base=GEMINI_BACKOFF_BASE, cap=GEMINI_BACKOFF_MAX):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class TokenBucket:
+    """Refills at `rate` units per second up to `capacity`; acquire blocks until enough units are available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1.0, deadline=None):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._available >= amount:
+                    self._available -= amount
+                    return
+                wait = (amount - self._available) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise GeminiDeadlineError("Rate limit wait would pass the request deadline")
+            time.sleep(wait)
+
+class FakeAPIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+class FakeGeminiBackend:
+    """Answers generate_content locally with unflagged results after a fixed latency.
+
+    A share of calls, set by `error_rate`, fails with a 429 like an exhausted quota, to exercise retries.
+    """
+
+    def __init__(self, latency=GEMINI_FAKE_LATENCY, error_rate=GEMINI_FAKE_ERROR_RATE):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.models = self
+
+    def generate_content(self, model, config, contents):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeAPIError(429, "RESOURCE_EXHAUSTED (fake backend)")
+        result = {"is_flagged": False, "tags": [], "reasons": [], "severity": "none"}
+        schema = getattr(config, "response_schema", None)
+        if schema is not None and getattr(schema, "properties", None):
+            # Combined requests expect one result per category in the schema.
+            result = {name: result for name in schema.properties}
+        text = json.dumps(result)
+        usage = SimpleNamespace(
+            prompt_token_count=estimate_tokens(contents + (getattr(config, "system_instruction", None) or "")),
+            candidates_token_count=estimate_tokens(text),
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+def google_backend(api_key, timeout=GEMINI_TIMEOUT):
+    from google import genai
+    from google.genai import types
+    return genai.Client(api_key=api_key, http_options=types.HttpOptions(timeout=int(timeout * 1000)))
+
+class GeminiClient:
+    """Quota-aware client for one API key: rate limits, caps concurrency, retries and enforces the budget."""
+
+    def __init__(self, backend, rpm=GEMINI_RPM, tpm=GEMINI_TPM, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                 max_retries=GEMINI_MAX_RETRIES, budget_usd=GEMINI_BUDGET_USD, budget_window=GEMINI_BUDGET_WINDOW):
+        self.backend = backend
+        # Ten seconds of quota may burst at once; the rest is paced at the per-minute rate.
+        self.requests = TokenBucket(rpm / 60.0, rpm / 6.0)
+        self.tokens = TokenBucket(tpm / 60.0, tpm / 6.0)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.budget_usd = budget_usd
+        self.budget_window = budget_window
+        self._spend = deque()  # (time, usd) per completed call
+        self._reserved = 0.0
+        self._spend_lock = threading.Lock()
+
+    def spent(self):
+        """USD charged to this key within the budget window."""
+        with self._spend_lock:
+            self._expire_spend()
+            return sum(usd for _, usd in self._spend)
+
+    def _expire_spend(self):
+        cutoff = time.time() - self.budget_window
+        while self._spend and self._spend[0][0] < cutoff:
+            self._spend.popleft()
+
+    def _reserve(self, input_tokens):
+        estimate = calculate_cost(input_tokens, GEMINI_OUTPUT_TOKEN_ESTIMATE)[0]
+        if not self.budget_usd:
+            return estimate
+        with self._spend_lock:
+            self._expire_spend()
+            committed = sum(usd for _, usd in self._spend) + self._reserved
+            if committed + estimate > self.budget_usd:
+                GEMINI_REJECTED.inc(reason="budget")
+                raise GeminiBudgetExceededError(
+                    f"Gemini budget of ${self.budget_usd} reached (${committed:.6f} committed, call needs ~${estimate:.6f})")
+            self._reserved += estimate
+        return estimate
+
+    def _settle(self, estimate, usage):
+        with self._spend_lock:
+            if self.budget_usd:
+                self._reserved -= estimate
+            if usage is not None:
+                cost = calculate_cost(usage.prompt_token_count or 0, usage.candidates_token_count or 0)[0]
+                self._spend.append((time.time(), cost))
+
+    def generate_content(self, model, config, contents, deadline=None):
+        """Sends one request, waiting for quota and retrying retryable errors until `deadline` (monotonic)."""
+        input_tokens = estimate_tokens(contents + (getattr(config, "system_instruction", None) or ""))
+        estimate = self._reserve(input_tokens)
+        usage = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                self.requests.acquire(1, deadline)
+                self.tokens.acquire(input_tokens + GEMINI_OUTPUT_TOKEN_ESTIMATE, deadline)
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                if not self.slots.acquire(timeout=timeout):
+                    GEMINI_REJECTED.inc(reason="concurrency")
+                    raise GeminiDeadlineError("No Gemini concurrency slot before the request deadline")
+                try:
+                    response = self.backend.models.generate_content(model=model, config=config, contents=contents)
+                    usage = getattr(response, "usage_metadata", None)
+                    return response
+                except Exception as e:
+                    if not is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    delay = backoff_delay(attempt)
+                    if deadline is not None and time.monotonic() + delay > deadline:
+                        raise
+                    GEMINI_RETRIES.inc(code=str(getattr(e, "code", None) or type(e).__name__))
+                    logger.warning(f"Gemini call failed ({e}); retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                finally:
+                    self.slots.release()
+                time.sleep(delay)
+        finally:
+            self._settle(estimate, usage)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def make_backend(api_key, backend=None):
+    backend = backend or GEMINI_BACKEND
+    if backend == "fake":
+        return FakeGeminiBackend()
+    if backend == "google":
+        return google_backend(api_key)
+    raise ValueError(f"Unknown Gemini backend '{backend}'; choose from google, fake")
+
+def get_client(api_key):
+    # One client per key, so calls share its connection pool, quota and budget.
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = GeminiClient(make_backend(api_key))
+            _clients[api_key] = client
+        return client
+
+def register_client(api_key, client):
+    """Serves `api_key` from the given client, e.g. a fake-backed one in benchmarks."""
+    with _clients_lock:
+        _clients[api_key] = client
+
+def load_test(requests=200, concurrency=32, error_rate=0.1, latency=0.05, rpm=600):
+    """Drives a fake-backed client from many threads and reports throughput, retries and failures."""
+    from concurrent.futures import ThreadPoolExecutor
+    client = GeminiClient(FakeGeminiBackend(latency=latency, error_rate=error_rate), rpm=rpm)
+    config = SimpleNamespace(system_instruction="load test", response_schema=None)
+    latencies, failures = [], []
+
+    def call(i):
+        start = time.monotonic()
+        try:
+            client.generate_content(model="fake", config=config, contents=f"request {i} " * 50,
+                                    deadline=start + GEMINI_TIMEOUT)
+            latencies.append(time.monotonic() - start)
+        except Exception as e:
+            failures.append(str(e))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(requests)))
+    elapsed = time.monotonic() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "succeeded": len(latencies),
+        "failed": len(failures),
+        "seconds": round(elapsed, 2),
+        "requests_per_minute": round(len(latencies) / elapsed * 60, 1) if elapsed else None,
+        "p50_s": round(latencies[len(latencies) // 2], 3) if latencies else None,
+        "p99_s": round(latencies[int(len(latencies) * 0.99)], 3) if latencies else None,
+        "spent_usd": round(client.spent(), 6),
+    }
+
+if __name__ == "__main__":
+    #   python gemini_client.py [requests] [concurrency] [error_rate] [rpm]
+    import sys
+    args = sys.argv[1:]
+    print(json.dumps(load_test(
+        requests=int(args[0]) if len(args) > 0 else 200,
+        concurrency=int(args[1]) if len(args) > 1 else 32,
+        error_rate=float(args[2]) if len(args) > 2 else 0.1,
+        rpm=float(args[3]) if len(args) > 3 else 600,
+    ), indent=2))
@@ -0,0 +1,119 @@
+import heapq
+import itertools
+import logging
+import os
+import subprocess
+import threading
+import time
+import uuid
+from telemetry import Gauge
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", 32))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 3600))
+# Seconds of video a queued job gains in priority per second it waits, so long videos cannot starve.
+JOB_AGING_RATE = float(os.environ.get("JOB_AGING_RATE", 1.0))
+# Priority given to uploads whose duration could not be probed.
+JOB_UNKNOWN_DURATION = float(os.environ.get("JOB_UNKNOWN_DURATION", 600))
+
+class QueueFullError(Exception):
+    pass
+
+def probe_duration(video_path):
+    """Reads the container duration with ffprobe without decoding any streams; None if it is unknown."""
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", video_path]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=10).stdout.strip()
+        return float(output)
+    except Exception as e:
+        logger.warning(f"Could not probe duration of {video_path}: {e}")
+        return None
+
+class JobQueue:
+    """Bounded worker pool that runs queued jobs shortest-video-first, with aging.
+
+    A job's priority is `duration - aging_rate * wait`. Every queued job ages at the same rate, so
+    this orders the same as the fixed key `duration + aging_rate * submit_time`, which the heap
+    stores. A job of duration D can only be overtaken by jobs submitted within D / aging_rate
+    seconds after it, which bounds its wait.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT, result_ttl=JOB_RESULT_TTL, aging_rate=JOB_AGING_RATE):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.result_ttl = result_ttl
+        self.aging_rate = aging_rate
+        self._heap = []
+        self._jobs = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _start_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _evict_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and now - job["finished_at"] > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def depth(self):
+        with self._cond:
+            return len(self._heap)
+
+    def submit(self, fn, duration, **kwargs):
+        """Queues `fn(**kwargs)`; raises QueueFullError once `queue_limit` jobs are waiting."""
+        with self._cond:
+            self._evict_expired()
+            if len(self._heap) >= self.queue_limit:
+                raise QueueFullError(f"Job queue is full ({self.queue_limit} jobs waiting)")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "duration": duration,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            # Ties keep submission order.
+            priority = (JOB_UNKNOWN_DURATION if duration is None else duration) + self.aging_rate * time.monotonic()
+            heapq.heappush(self._heap, (priority, next(self._seq), job_id, fn, kwargs))
+            self._start_workers()
+            self._cond.notify()
+            return job_id
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job_id, fn, kwargs = heapq.heappop(self._heap)
+                job = self._jobs[job_id]
+                job["status"] = "running"
+                job["started_at"] = time.time()
+            try:
+                result = fn(**kwargs)
+                status, error = "done", None
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                result, status, error = None, "failed", str(e)
+            with self._cond:
+                job.update(status=status, result=result, error=error, finished_at=time.time())
+
+job_queue = JobQueue()
+Gauge("moderation_job_queue_depth", "Jobs waiting for a worker.", callback=job_queue.depth)
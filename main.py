@@ -1,10 +1,25 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
-from analysis import analyze_video
+from analysis import analyze_video, analyze_video_verdict, analyze_videos, validate_gemini_mode, warmup, models_ready, PRELOAD_DETECTORS
+from asr import ASR_BACKEND, ASR_MODEL_SIZE
+from model_registry import registry
+import violence_detector
+import detector_pool
+from jobs import job_queue, probe_duration, QueueFullError
+from telemetry import collect_timings, render_metrics, stream_events
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
 import tempfile
 import os
-from typing import Optional
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -17,6 +32,145 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Limits of 0 disable the check.
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 0))
+# Allowance for the multipart boundaries and form fields around the video(s).
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+UPLOAD_MAX_DURATION = float(os.environ.get("UPLOAD_MAX_DURATION", 0))
+# Videos per /analyze/batch request; they are decoded one at a time, but their uploads and transcripts are held together.
+BATCH_MAX_VIDEOS = int(os.environ.get("BATCH_MAX_VIDEOS", 16))
+# Directory that /analyze/batch may read local `video_paths` from; empty disables local paths.
+BATCH_LOCAL_ROOT = os.environ.get("BATCH_LOCAL_ROOT", "")
+# Token the model admin routes require in X-Admin-Token; empty disables those routes.
+MODEL_ADMIN_TOKEN = os.environ.get("MODEL_ADMIN_TOKEN", "")
+
+class UploadRejectedError(Exception):
+    pass
+
+@app.middleware("http")
+async def limit_request_size(request, call_next):
+    # FastAPI spools the whole multipart body to disk before an endpoint runs, so an oversized
+    # upload has to be refused from its Content-Length here, before anything is read.
+    length = request.headers.get("content-length")
+    if UPLOAD_MAX_BYTES and request.method == "POST" and length and length.isdigit():
+        videos = BATCH_MAX_VIDEOS if request.url.path == "/analyze/batch" else 1
+        limit = UPLOAD_MAX_BYTES * videos + UPLOAD_FORM_OVERHEAD
+        if int(length) > limit:
+            return JSONResponse(status_code=413, content={"error": f"Request exceeds size limit of {limit} bytes"})
+    return await call_next(request)
+
+async def save_upload(video: UploadFile, probe=False):
+    """Streams the upload to a temp file in fixed-size chunks, hashing it on the way.
+
+    Returns (path, sha256 hex digest, duration in seconds or None). The duration is only probed
+    (one ffprobe run) when `probe` is set or UPLOAD_MAX_DURATION is, and is None otherwise.
+    Uploads over the size or duration limits raise UploadRejectedError and leave nothing on
+    disk. The size check here covers chunked requests without a Content-Length, which
+    limit_request_size cannot see.
+    """
+    # Save uploaded file temporarily
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(video.filename)[1])
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        while chunk := await video.read(UPLOAD_CHUNK_SIZE):
+            written += len(chunk)
+            if UPLOAD_MAX_BYTES and written > UPLOAD_MAX_BYTES:
+                raise UploadRejectedError(f"Upload exceeds size limit of {UPLOAD_MAX_BYTES} bytes")
+            digest.update(chunk)
+            temp_file.write(chunk)
+        temp_file.close()
+
+        duration = None
+        if probe or UPLOAD_MAX_DURATION:
+            duration = await run_in_threadpool(probe_duration, temp_file.name)
+        if UPLOAD_MAX_DURATION and duration is not None and duration > UPLOAD_MAX_DURATION:
+            raise UploadRejectedError(f"Video duration {duration:.1f}s exceeds limit of {UPLOAD_MAX_DURATION:.0f}s")
+    except Exception:
+        temp_file.close()
+        os.remove(temp_file.name)
+        raise
+    return temp_file.name, digest.hexdigest(), duration
+
+class InvalidFormError(Exception):
+    pass
+
+@app.exception_handler(InvalidFormError)
+async def invalid_form(request, exc):
+    return JSONResponse(status_code=400, content={"error": str(exc)})
+
+def gemini_mode_form(gemini_mode: Optional[str] = Form(None)):
+    """The request's `gemini_mode` form field, defaulted and validated; unknown modes get a 400."""
+    try:
+        return validate_gemini_mode(gemini_mode)
+    except ValueError as e:
+        raise InvalidFormError(str(e))
+
+def result_dict(result):
+    transcript, abusive_table, violent_table, nsfw_audio_table, political_table, religious_table, video_nsfw_info, video_violence_info = result
+    return {
+        "transcript": transcript,
+        "abusive_table": abusive_table,
+        "violent_table": violent_table,
+        "nsfw_audio_table": nsfw_audio_table,
+        "political_table": political_table,
+        "religious_table": religious_table,
+        "video_nsfw_info": video_nsfw_info,
+        "video_violence_info": video_violence_info
+    }
+
+def run_analysis(video_path, gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious, gemini_mode=None, video_hash=None, include_timings=False, verdict_only=False):
+    if verdict_only:
+        with collect_timings() as timings:
+            response = analyze_video_verdict(
+                gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious,
+                video_path, gemini_mode
+            )
+        if include_timings:
+            response["timings"] = timings
+        return response
+
+    # Analyze the video with the additional flags for political and religious analysis
+    with collect_timings() as timings:
+        result = analyze_video(
+            gemini_api=gemini_api,
+            detect_abusive=detect_abusive,
+            detect_violent=detect_violent,
+            detect_nsfw=detect_nsfw,
+            detect_political=detect_political,
+            detect_religious=detect_religious,
+            video_path=video_path,
+            gemini_mode=gemini_mode,
+            video_hash=video_hash
+        )
+    response = result_dict(result)
+    if include_timings:
+        # Seconds per stage; stages that ran concurrently overlap, so they can sum past the total.
+        response["timings"] = timings
+    return response
+
+def run_batch_analysis(names, video_paths, video_hashes, gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious, gemini_mode=None, include_timings=False):
+    with collect_timings() as timings:
+        results = analyze_videos(
+            gemini_api, detect_abusive, detect_violent, detect_nsfw, detect_political, detect_religious,
+            video_paths, gemini_mode, video_hashes, remove_files=False
+        )
+    response = {"results": [{"video": name, **result_dict(result)} for name, result in zip(names, results)]}
+    if include_timings:
+        response["timings"] = timings
+    return response
+
+def local_video_path(path):
+    """Resolves a local batch path, refusing anything outside BATCH_LOCAL_ROOT."""
+    if not BATCH_LOCAL_ROOT:
+        raise ValueError("Local video paths are disabled (set BATCH_LOCAL_ROOT)")
+    root = os.path.realpath(BATCH_LOCAL_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Path is outside BATCH_LOCAL_ROOT: {path}")
+    return resolved
+
 @app.post("/analyze")
 async def analyze_content(
     video: UploadFile = File(...),
@@ -25,39 +179,251 @@ async def analyze_content(
     detect_violent: bool = Form(False),
     detect_nsfw: bool = Form(False),
     detect_political: bool = Form(False),
-    detect_religious: bool = Form(False)
+    detect_religious: bool = Form(False),
+    gemini_mode: str = Depends(gemini_mode_form),
+    include_timings: bool = Form(False),
+    verdict_only: bool = Form(False)
 ):
-    # Save uploaded file temporarily
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(video.filename)[1])
     try:
-        content = await video.read()
-        temp_file.write(content)
-        temp_file.close()
+        video_path, video_hash, _ = await save_upload(video)
+        # analyze_video blocks for the whole pipeline, so keep it off the event loop.
+        return await run_in_threadpool(
+            run_analysis, video_path, gemini_api, detect_abusive, detect_violent,
+            detect_nsfw, detect_political, detect_religious, gemini_mode, video_hash, include_timings, verdict_only
+        )
+
+    except UploadRejectedError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except Exception as e:
+        return {"error": str(e)}
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/analyze/stream")
+async def analyze_stream(
+    video: UploadFile = File(...),
+    gemini_api: str = Form(...),
+    detect_abusive: bool = Form(False),
+    detect_violent: bool = Form(False),
+    detect_nsfw: bool = Form(False),
+    detect_political: bool = Form(False),
+    detect_religious: bool = Form(False),
+    gemini_mode: str = Depends(gemini_mode_form),
+    include_timings: bool = Form(False)
+):
+    """Like /analyze, but streams Server-Sent Events as each part of the result is ready.
+
+    `transcript`, `table`, `video_nsfw_info` and `video_violence_info` events each carry a subset of
+    the /analyze response keys; `progress` events report stages and frames processed; the last
+    event is `result` with the full response, or `error`.
+    """
+    try:
+        video_path, video_hash, _ = await save_upload(video)
+    except UploadRejectedError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except Exception as e:
+        return {"error": str(e)}
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def send(event, data):
+        # Called from pipeline threads; the queue belongs to the event loop.
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    def run():
+        try:
+            with stream_events(send):
+                send("result", run_analysis(
+                    video_path, gemini_api, detect_abusive, detect_violent, detect_nsfw,
+                    detect_political, detect_religious, gemini_mode, video_hash, include_timings
+                ))
+        except Exception as e:
+            send("error", {"error": str(e)})
+        finally:
+            send(None, None)
+
+    async def stream():
+        analysis = asyncio.ensure_future(run_in_threadpool(run))
+        while True:
+            event, data = await events.get()
+            if event is None:
+                break
+            yield sse_message(event, data)
+        await analysis
+
+    # X-Accel-Buffering stops nginx-style proxies from holding events back until the end.
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    videos: List[UploadFile] = File([]),
+    video_paths: str = Form(""),
+    gemini_api: str = Form(...),
+    detect_abusive: bool = Form(False),
+    detect_violent: bool = Form(False),
+    detect_nsfw: bool = Form(False),
+    detect_political: bool = Form(False),
+    detect_religious: bool = Form(False),
+    gemini_mode: str = Depends(gemini_mode_form),
+    include_timings: bool = Form(False)
+):
+    # `video_paths` is newline-separated, relative to BATCH_LOCAL_ROOT; local files are never deleted.
+    local_paths = [path.strip() for path in video_paths.splitlines() if path.strip()]
+    if not videos and not local_paths:
+        return JSONResponse(status_code=400, content={"error": "No videos or video_paths given"})
+    if len(videos) + len(local_paths) > BATCH_MAX_VIDEOS:
+        return JSONResponse(status_code=413, content={"error": f"Batch exceeds limit of {BATCH_MAX_VIDEOS} videos"})
+
+    try:
+        resolved_paths = [local_video_path(path) for path in local_paths]
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    names, paths, hashes, uploaded = [], [], [], []
+    try:
+        for video in videos:
+            video_path, video_hash, _ = await save_upload(video)
+            uploaded.append(video_path)
+            names.append(video.filename)
+            paths.append(video_path)
+            hashes.append(video_hash)
+        names += local_paths
+        paths += resolved_paths
+        hashes += [None] * len(local_paths)
+
+        return await run_in_threadpool(
+            run_batch_analysis, names, paths, hashes, gemini_api, detect_abusive, detect_violent,
+            detect_nsfw, detect_political, detect_religious, gemini_mode, include_timings
+        )
+
+    except UploadRejectedError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except Exception as e:
+        return {"error": str(e)}
+    finally:
+        for video_path in uploaded:
+            if os.path.exists(video_path):
+                os.remove(video_path)
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    video: UploadFile = File(...),
+    gemini_api: str = Form(...),
+    detect_abusive: bool = Form(False),
+    detect_violent: bool = Form(False),
+    detect_nsfw: bool = Form(False),
+    detect_political: bool = Form(False),
+    detect_religious: bool = Form(False),
+    gemini_mode: str = Depends(gemini_mode_form),
+    include_timings: bool = Form(False),
+    verdict_only: bool = Form(False)
+):
+    try:
+        # The job queue orders jobs by duration, so always probe here.
+        video_path, video_hash, duration = await save_upload(video, probe=True)
+    except UploadRejectedError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except Exception as e:
+        return {"error": str(e)}
 
-        # Analyze the video with the additional flags for political and religious analysis
-        transcript, abusive_table, violent_table, nsfw_audio_table, political_table, religious_table, video_nsfw_info, video_violence_info = analyze_video(
+    try:
+        job_id = job_queue.submit(
+            run_analysis,
+            duration,
+            video_path=video_path,
             gemini_api=gemini_api,
             detect_abusive=detect_abusive,
             detect_violent=detect_violent,
             detect_nsfw=detect_nsfw,
             detect_political=detect_political,
             detect_religious=detect_religious,
-            video_path=temp_file.name
+            gemini_mode=gemini_mode,
+            video_hash=video_hash,
+            include_timings=include_timings,
+            verdict_only=verdict_only,
         )
+    except QueueFullError as e:
+        os.remove(video_path)
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "30"})
+
+    return {"job_id": job_id, "status": "queued", "duration": duration}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+    return job
 
-        return {
-            "transcript": transcript,
-            "abusive_table": abusive_table,
-            "violent_table": violent_table,
-            "nsfw_audio_table": nsfw_audio_table,
-            "political_table": political_table,
-            "religious_table": religious_table,
-            "video_nsfw_info": video_nsfw_info,
-            "video_violence_info": video_violence_info
-        }
+# Why the startup preload failed, reported by /ready.
+preload_error = None
 
+def run_preload():
+    global preload_error
+    try:
+        warmup(PRELOAD_DETECTORS)
+    except Exception as e:
+        logger.exception(f"Preloading {PRELOAD_DETECTORS} failed")
+        preload_error = f"{type(e).__name__}: {e}"
+
+@app.on_event("startup")
+async def preload_models():
+    # Load in the background so the server starts at once; /ready reports 503 until the preload finishes.
+    if PRELOAD_DETECTORS:
+        asyncio.get_running_loop().run_in_executor(None, run_preload)
+    if detector_pool.enabled():
+        asyncio.get_running_loop().run_in_executor(None, detector_pool.start)
+
+@app.on_event("shutdown")
+def stop_detector_pool():
+    detector_pool.shutdown()
+
+@app.post("/warmup")
+def warmup_models(detectors: str = Form("all")):
+    try:
+        return {"resident": warmup(detectors)}
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/ready")
+async def readiness():
+    # Ready once every model the deployment preloads is resident; lazily loaded ones are listed as they arrive.
+    ready = models_ready(PRELOAD_DETECTORS) if PRELOAD_DETECTORS else True
+    content = {"ready": ready, "resident": registry.loaded()}
+    if not ready and preload_error:
+        content["error"] = preload_error
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+@app.get("/asr/stats")
+async def asr_stats():
+    asr_backend = registry.get_resident("asr")
+    if asr_backend is None:
+        return {"backend": ASR_BACKEND, "model_size": ASR_MODEL_SIZE, "loaded": False}
+    return asr_backend.stats()
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.post("/models/violence/reload")
+def reload_violence_model(model_path: str = Form(...), x_admin_token: str = Header("")):
+    # Swap in a new checkpoint without restarting; in-flight requests finish on the old weights.
+    if not MODEL_ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"error": "Model reload is disabled (set MODEL_ADMIN_TOKEN)"})
+    if not hmac.compare_digest(x_admin_token.encode(), MODEL_ADMIN_TOKEN.encode()):
+        return JSONResponse(status_code=401, content={"error": "Invalid admin token"})
+    try:
+        resolved = violence_detector.reload_model(model_path)
+        return {"model": "violence", "model_path": resolved}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except FileNotFoundError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=422, content={"error": f"Could not load checkpoint: {e}"})
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
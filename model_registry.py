@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+from telemetry import MODEL_LOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class ModelRegistry:
+    """Process-wide cache of loaded models, keyed by name and the source (e.g. checkpoint path) they came from."""
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def resident_source(self, name):
+        """Returns the source the resident model was loaded from, or None if it is not loaded."""
+        entry = self._entries.get(name)
+        return entry[0] if entry else None
+
+    def get_resident(self, name):
+        """Returns the resident model without loading anything, or None."""
+        entry = self._entries.get(name)
+        return entry[1] if entry else None
+
+    def loaded(self):
+        """Returns a mapping of resident model names to their sources."""
+        return {name: source for name, (source, _) in list(self._entries.items())}
+
+    def get(self, name, loader, source):
+        """Returns the resident model, loading it with `loader(source)` on first use or when `source` changes."""
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == source:
+            return entry[1]
+        with self._name_lock(name):
+            # Another thread may have finished loading while we waited for the lock.
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == source:
+                return entry[1]
+            return self._load(name, loader, source)
+
+    def reload(self, name, loader, source):
+        """Loads `source` and swaps it in; requests already holding the old model finish with it."""
+        with self._name_lock(name):
+            return self._load(name, loader, source)
+
+    def evict(self, name):
+        with self._name_lock(name):
+            self._entries.pop(name, None)
+
+    def _load(self, name, loader, source):
+        logger.info(f"Loading model '{name}' from {source}")
+        start = time.monotonic()
+        model = loader(source)
+        elapsed = time.monotonic() - start
+        self._entries[name] = (source, model)
+        MODEL_LOAD_SECONDS.set(round(elapsed, 3), model=name)
+        logger.info(f"Model '{name}' loaded in {elapsed:.2f}s.")
+        return model
+
+registry = ModelRegistry()
@@ -1,110 +1,286 @@
-import os
-import cv2
+import logging
+import numpy as np
 import torch
-import matplotlib.pyplot as plt
-from transformers import ViTImageProcessor, AutoModelForImageClassification, pipeline
-from PIL import Image
-import shutil
+from transformers import ViTImageProcessor, AutoModelForImageClassification, AutoConfig, AutoImageProcessor, pipeline
+import itertools
+import math
+import os
 import random
+from types import SimpleNamespace
+from onnx_runtime import OnnxModel, onnx_path, INFERENCE_RUNTIME
+from frame_decoder import decode_frames, stream_frames, perceptual_hash, hash_distance
+from model_registry import registry
+from telemetry import span, emit
+import verdict
+
+logger = logging.getLogger(__name__)
 
-# Load Model 1: ViT-based NSFW detector
-print("Loading ViT-based NSFW detector...")
-processor = ViTImageProcessor.from_pretrained('AdamCodd/vit-base-nsfw-detector')
-model = AutoModelForImageClassification.from_pretrained('AdamCodd/vit-base-nsfw-detector')
+VIT_MODEL_NAME = 'AdamCodd/vit-base-nsfw-detector'
+PIPELINE_MODEL_NAME = 'quentintaranpino/nsfw-image-classifier'
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-print(f"ViT model loaded on {device}.")
 
-# Load Model 2: NSFW image classifier
-print("Loading pipeline-based NSFW image classifier...")
-pipe = pipeline("image-classification", model="quentintaranpino/nsfw-image-classifier")
-print("Pipeline model loaded.")
+def load_vit(model_name, runtime=None):
+    # Model 1: ViT-based NSFW detector
+    logger.info("Loading ViT-based NSFW detector...")
+    processor = ViTImageProcessor.from_pretrained(model_name)
+    if (runtime or INFERENCE_RUNTIME) == "onnx":
+        model = OnnxModel(onnx_path("nsfw_vit"), config=AutoConfig.from_pretrained(model_name))
+        logger.info("ViT model loaded on ONNX Runtime.")
+        return processor, model
+    model = AutoModelForImageClassification.from_pretrained(model_name)
+    model.to(device)
+    model.eval()
+    logger.info(f"ViT model loaded on {device}.")
+    return processor, model
+
+def load_pipeline(model_name, runtime=None):
+    # Model 2: NSFW image classifier
+    logger.info("Loading pipeline-based NSFW image classifier...")
+    if (runtime or INFERENCE_RUNTIME) == "onnx":
+        # Only the model and image processor are used, so no full pipeline is built.
+        pipe = SimpleNamespace(
+            model=OnnxModel(onnx_path("nsfw_pipeline"), config=AutoConfig.from_pretrained(model_name)),
+            image_processor=AutoImageProcessor.from_pretrained(model_name),
+        )
+        logger.info("Pipeline model loaded on ONNX Runtime.")
+        return pipe
+    pipe = pipeline("image-classification", model=model_name)
+    logger.info("Pipeline model loaded.")
+    return pipe
+
+def get_vit():
+    """Returns the (processor, model) pair, loading it on first use."""
+    return registry.get("nsfw_vit", load_vit, VIT_MODEL_NAME)
+
+def get_pipeline():
+    return registry.get("nsfw_pipeline", load_pipeline, PIPELINE_MODEL_NAME)
+
+def load_models():
+    get_vit()
+    get_pipeline()
 
 # NSFW Threshold for Model 2
 threshold = 0.60
 
-def extract_frames(video_path, output_dir, frame_interval=1):
-    """Extracts frames from a video at a specified interval."""
-    print("Extracting frames from video...")
-    os.makedirs(output_dir, exist_ok=True)
-    cap = cv2.VideoCapture(video_path)
-    frame_count = 0
-    count = 0
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if frame_count % frame_interval == 0:
-            count += 1
-            frame_path = os.path.join(output_dir, f"frame_{frame_count}.jpg")
-            cv2.imwrite(frame_path, frame)
-            print(f"Extracted frame {frame_count} to {frame_path}")
-
-        frame_count += 1
-
-    cap.release()
-    print(f"Total frames extracted: {count}")
-    return
-
-def process_images_vit(frames_dir, batch_size=256):
-    """Processes images using the ViT-based NSFW model in batches."""
-    print("Processing images using ViT-based model...")
+# "uniform" classifies every sampled frame; "adaptive" classifies one representative per shot.
+NSFW_SAMPLING = os.environ.get("NSFW_SAMPLING", "uniform")
+# Max dHash bit difference from the shot's representative before a frame starts a new shot.
+NSFW_HASH_THRESHOLD = int(os.environ.get("NSFW_HASH_THRESHOLD", 8))
+# Max frames a representative may stand in for, so slow changes are still re-checked.
+NSFW_MAX_GAP = int(os.environ.get("NSFW_MAX_GAP", 15))
+
+# A video is NSFW when at least this fraction of its frames is.
+NSFW_FRAME_RATIO = 0.05
+# Early exit stops classifying once the NSFW fraction is confidently on one side of NSFW_FRAME_RATIO.
+NSFW_EARLY_EXIT = os.environ.get("NSFW_EARLY_EXIT", "0") == "1"
+# Chance, across all of a video's looks together, that a statistical early exit lands on the wrong side.
+NSFW_EARLY_EXIT_ALPHA = float(os.environ.get("NSFW_EARLY_EXIT_ALPHA", 0.01))
+NSFW_EARLY_EXIT_BATCH = int(os.environ.get("NSFW_EARLY_EXIT_BATCH", 32))
+NSFW_EARLY_EXIT_MIN_FRAMES = int(os.environ.get("NSFW_EARLY_EXIT_MIN_FRAMES", 30))
+# Frames early exit draws at random and holds while the video streams past; only those can stop it on
+# the statistical test, and an undecided video gets a second decode pass with exact bounds only.
+NSFW_EARLY_EXIT_SAMPLE = int(os.environ.get("NSFW_EARLY_EXIT_SAMPLE", 256))
+
+# "or" runs both models on every frame; "cascade" only sends frames the ViT model is unsure about to the second model.
+NSFW_ENSEMBLE = os.environ.get("NSFW_ENSEMBLE", "or")
+# Lowest ViT NSFW probability at which a frame the ViT calls sfw still goes to the second model. There is
+# no upper setting: the ViT labels a frame nsfw once its probability passes 0.5, which settles the OR.
+NSFW_CASCADE_LOW = float(os.environ.get("NSFW_CASCADE_LOW", 0.01))
+
+# Working-memory budget that sizes the classifier micro-batches.
+NSFW_MEMORY_BUDGET_MB = float(os.environ.get("NSFW_MEMORY_BUDGET_MB", 1024))
+# Peak ViT-base activations per frame at a 224x224 input; frame_batch_size scales it to the real input.
+NSFW_ACTIVATION_BYTES_PER_FRAME = 8 * 1024 * 1024
+
+def sample_frames(frames, frame_interval=1):
+    """Selects frames from the decoded video at a specified interval, keyed by frame index."""
+    sampled = {i: frames[i] for i in range(0, len(frames), frame_interval)}
+    logger.debug(f"Total frames sampled: {len(sampled)}")
+    return sampled
+
+def sample_stream(frames, frame_interval=1):
+    """Yields (frame_id, frame) for every `frame_interval`-th frame of an array or an (index, frame) stream."""
+    pairs = enumerate(frames) if isinstance(frames, np.ndarray) else frames
+    return ((frame_id, frame) for frame_id, frame in pairs if frame_id % frame_interval == 0)
+
+def iter_representatives(frames, assignment, hash_threshold=NSFW_HASH_THRESHOLD, max_gap=NSFW_MAX_GAP):
+    """Yields one representative (frame_id, frame) per shot from (frame_id, frame) pairs, as they arrive.
+
+    Every frame's representative is recorded in `assignment`, so each label can be spread to the
+    near-duplicates it stands in for.
+    """
+    rep_id, rep_hash = None, None
+    for frame_id, frame in frames:
+        frame_hash = perceptual_hash(frame)
+        if (rep_id is None or frame_id - rep_id >= max_gap
+                or hash_distance(frame_hash, rep_hash) > hash_threshold):
+            rep_id, rep_hash = frame_id, frame_hash
+            yield frame_id, frame
+        assignment[frame_id] = rep_id
+
+@span("nsfw_adaptive_sampling")
+def adaptive_sample(frames, hash_threshold=NSFW_HASH_THRESHOLD, max_gap=NSFW_MAX_GAP):
+    """Picks one representative frame per shot from the sampled frames.
+
+    Returns the representatives to classify and a mapping from every sampled frame to its
+    representative, so each label can be spread to the near-duplicates it stands in for.
+    """
+    assignment = {}
+    representatives = dict(iter_representatives(frames.items(), assignment, hash_threshold, max_gap))
+    logger.info(f"Adaptive sampling kept {len(representatives)} of {len(frames)} frames.")
+    return representatives, assignment
+
+def input_hw(processor, model):
+    """(height, width) the image model expects: its processor's resize, else the model config's image size."""
+    params = shared_preprocessing(processor)
+    if params is not None:
+        return params[2]
+    size = getattr(model.config, "image_size", 224)
+    return (size, size) if isinstance(size, int) else tuple(size)
+
+def input_sizes():
+    """(height, width) inputs of the ViT and pipeline models, in that order."""
+    processor, model = get_vit()
+    pipe = get_pipeline()
+    return [input_hw(processor, model), input_hw(pipe.image_processor, pipe.model)]
+
+def frame_size():
+    """(width, height) to decode frames at for NSFW: the larger model input, so neither model upscales."""
+    height, width = max(input_sizes(), key=lambda hw: hw[0] * hw[1])
+    return width, height
+
+def frame_batch_size(budget_mb=NSFW_MEMORY_BUDGET_MB, sizes=None):
+    """Frames per batch that keep the float inputs and model activations within the memory budget."""
+    sizes = sizes or input_sizes()
+    pixels = [height * width for height, width in sizes]
+    # Shared [0, 1] tensor at the decode size + one normalized copy per model + a ViT-base activation
+    # estimate under no_grad, which grows with the patch count and so with the input area.
+    input_bytes = 3 * 4 * (max(pixels) + sum(pixels))
+    per_frame = input_bytes + NSFW_ACTIVATION_BYTES_PER_FRAME * max(pixels) // (224 * 224)
+    return max(1, int(budget_mb * 1024 * 1024) // per_frame)
+
+def shared_preprocessing(processor):
+    """Returns (mean, std, (height, width)) if the processor is a plain resize + rescale + normalize, else None."""
+    if getattr(processor, "do_center_crop", False) or not getattr(processor, "do_rescale", True):
+        return None
+    if abs(getattr(processor, "rescale_factor", 1 / 255) - 1 / 255) > 1e-9:
+        return None
+    size = getattr(processor, "size", None) or {}
+    if "height" in size and "width" in size:
+        hw = (size["height"], size["width"])
+    elif "shortest_edge" in size:
+        # Decoded frames are square, so a shortest-edge resize is a square resize.
+        hw = (size["shortest_edge"], size["shortest_edge"])
+    else:
+        return None
+    if getattr(processor, "do_normalize", True):
+        mean, std = processor.image_mean, processor.image_std
+    else:
+        mean, std = [0.0, 0.0, 0.0], [1.0, 1.0, 1.0]
+    return torch.tensor(mean).view(1, 3, 1, 1), torch.tensor(std).view(1, 3, 1, 1), hw
+
+def to_base_tensor(batch, target_device):
+    """Converts a uint8 (B, H, W, 3) batch into one float (B, 3, H, W) tensor in [0, 1] shared by both models."""
+    return torch.from_numpy(np.ascontiguousarray(batch)).to(target_device).permute(0, 3, 1, 2).float().div_(255.0)
+
+def model_pixel_values(base, processor, batch):
+    """Derives a model's normalized input from the shared tensor, or runs its own processor if it needs more."""
+    params = shared_preprocessing(processor)
+    if params is None:
+        return processor(images=list(batch), return_tensors="pt")["pixel_values"].to(base.device)
+    mean, std, hw = params
+    if tuple(base.shape[-2:]) != hw:
+        # Frames are decoded at the larger model's input, so this is a downscale; antialias it like a resize would.
+        base = torch.nn.functional.interpolate(base, size=hw, mode="bilinear", align_corners=False, antialias=True)
+    return (base - mean.to(base.device)) / std.to(base.device)
+
+@span("nsfw_vit_batch")
+def vit_forward(base, batch, vit=None):
+    processor, model = vit or get_vit()
+    nsfw_idx = next(idx for idx, label in model.config.id2label.items() if label.lower() == "nsfw")
+    with torch.no_grad():
+        logits = model(pixel_values=model_pixel_values(base, processor, batch)).logits
+    probabilities = logits.softmax(dim=-1)
+    labels = [model.config.id2label[idx] for idx in logits.argmax(dim=-1).tolist()]
+    return labels, probabilities[:, nsfw_idx].tolist()
+
+@span("nsfw_pipeline_batch")
+def pipeline_forward(base, batch, pipe=None):
+    """Runs the pipeline classifier's model directly on the shared tensor, scoring like the pipeline does."""
+    pipe = pipe or get_pipeline()
+    config = pipe.model.config
+    with torch.no_grad():
+        logits = pipe.model(pixel_values=model_pixel_values(base.to(pipe.model.device), pipe.image_processor, batch)).logits
+    if config.problem_type == "multi_label_classification" or config.num_labels == 1:
+        probabilities = logits.sigmoid()
+    else:
+        probabilities = logits.softmax(dim=-1)
+    labels, scores = [], []
+    for row in probabilities.tolist():
+        row_scores = {config.id2label[idx]: score for idx, score in enumerate(row)}
+        nsfw_score = row_scores.get("UNSAFE", 0) + row_scores.get("QUESTIONABLE", 0)
+        labels.append("NSFW" if nsfw_score > threshold else "SFW")
+        scores.append(nsfw_score)
+    return labels, scores
+
+def iter_uniform(frames, assignment):
+    """Passes (frame_id, frame) pairs through, recording each frame as its own representative in `assignment`."""
+    for frame_id, frame in frames:
+        assignment[frame_id] = frame_id
+        yield frame_id, frame
+
+def chunked(pairs, size):
+    pairs = iter(pairs)
+    while chunk := list(itertools.islice(pairs, size)):
+        yield chunk
+
+def iter_batches(frames, batch_size=None):
+    """Yields (frame_ids, uint8 batch, shared float tensor) micro-batches, one at a time.
+
+    `frames` is a dict or an iterable of (frame_id, frame) pairs; a decode stream is read only one
+    micro-batch ahead.
+    """
+    pairs = frames.items() if isinstance(frames, dict) else frames
+    for chunk in chunked(pairs, batch_size or frame_batch_size()):
+        batch_ids = [frame_id for frame_id, _ in chunk]
+        batch = np.stack([frame for _, frame in chunk])
+        del chunk
+        yield batch_ids, batch, to_base_tensor(batch, device)
+
+def process_images_vit(frames, batch_size=None, return_scores=False):
+    """Processes in-memory frames using the ViT-based NSFW model in memory-bounded batches.
+
+    With `return_scores`, also returns each frame's NSFW probability for the cascade.
+    """
+    logger.debug("Processing images using ViT-based model...")
     vit_predictions = {}
-    n = len(os.listdir(frames_dir))
-    image_paths = [os.path.join(frames_dir, f) for f in os.listdir(frames_dir) if f.endswith('.jpg')]
-
-    for i in range(0, n, batch_size):
-        batch_paths = image_paths[i:i+batch_size]
-        print(f"Processing ViT batch {i // batch_size + 1} with {len(batch_paths)} images...")
-        # Load and convert images in batch
-        images = [Image.open(path).convert("RGB") for path in batch_paths]
-        inputs = processor(images=images, return_tensors="pt")
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-        logits = outputs.logits  # Shape: (batch_size, num_classes)
-
-        # Process each image in the batch
-        for j, path in enumerate(batch_paths):
-            predicted_class_idx = logits[j].argmax().item()
-            predicted_label = model.config.id2label[predicted_class_idx]
-            vit_predictions[path] = predicted_label
-            print(f"ViT prediction for {path}: {predicted_label}")
-
-    print("ViT processing complete.")
+    vit_scores = {}
+
+    for batch_ids, batch, base in iter_batches(frames, batch_size):
+        labels, scores = vit_forward(base, batch)
+        for frame_id, label, score in zip(batch_ids, labels, scores):
+            vit_predictions[frame_id] = label
+            vit_scores[frame_id] = score
+        logger.debug(f"ViT batch of {len(batch_ids)} frames: {sum(label.lower() == 'nsfw' for label in labels)} nsfw")
+        del base
+
+    logger.debug("ViT processing complete.")
+    if return_scores:
+        return vit_predictions, vit_scores
     return vit_predictions
 
-def process_images_pipeline(frames_dir, batch_size=256):
-    """Processes images using the pipeline-based NSFW classifier in batches."""
-    print("Processing images using pipeline-based classifier...")
+def process_images_pipeline(frames, batch_size=None):
+    """Processes in-memory frames using the pipeline-based NSFW classifier in memory-bounded batches."""
+    logger.debug("Processing images using pipeline-based classifier...")
     pipeline_predictions = {}
-    n = len(os.listdir(frames_dir))
-    image_paths = [os.path.join(frames_dir, f) for f in os.listdir(frames_dir) if f.endswith('.jpg')]
-
-    for i in range(0, n, batch_size):
-        batch_paths = image_paths[i:i+batch_size]
-        print(f"Processing pipeline batch {i // batch_size + 1} with {len(batch_paths)} images...")
-        # Load images in batch
-        images = [Image.open(path).convert("RGB") for path in batch_paths]
-        # The pipeline can process a list of images
-        results = pipe(images)
-
-        # When batch size is greater than 1, results is a list of lists:
-        for path, result in zip(batch_paths, results):
-            # If result is a list (for multi-label outputs) then extract scores
-            scores = {entry['label']: entry['score'] for entry in result} if isinstance(result, list) else {result['label']: result['score']}
-            nsfw_score = scores.get("UNSAFE", 0) + scores.get("QUESTIONABLE", 0)
-            final_label = "NSFW" if nsfw_score > threshold else "SFW"
-            pipeline_predictions[path] = final_label
-            if final_label == "NSFW":
-                print(f"Pipeline prediction for {path}: {final_label} (score: {nsfw_score})")
-            else:
-                print(f"Pipeline prediction for {path}: {final_label} (score: {1.0-nsfw_score})")
 
-    print("Pipeline processing complete.")
+    for batch_ids, batch, base in iter_batches(frames, batch_size):
+        labels, _ = pipeline_forward(base, batch)
+        pipeline_predictions.update(zip(batch_ids, labels))
+        logger.debug(f"Pipeline batch of {len(batch_ids)} frames: {labels.count('NSFW')} nsfw")
+        del base
+
+    logger.debug("Pipeline processing complete.")
     return pipeline_predictions
 
 def count_predictions(pred_dict):
@@ -122,41 +298,230 @@ def count_predictions(pred_dict):
 def empty_cuda():
     # Empty GPU memory after ViT processing
     if torch.cuda.is_available():
-        print("Emptying CUDA cache...")
         torch.cuda.empty_cache()
-        print("CUDA cache emptied.")
+        logger.debug("CUDA cache emptied.")
 
-def main(video_path, frame_interval=1):
-    """Main function: Extracts frames, runs models, and determines NSFW status."""
-    print(f"Starting NSFW detection for video: {video_path}")
-    output_dir = "./video_frames"
-    # Remove the directory if it exists, otherwise create it
-    if os.path.exists(output_dir):
-        print("Removing existing frames directory...")
-        shutil.rmtree(output_dir)
-    os.makedirs(output_dir, exist_ok=True)
+def combine_labels(label_vit, label_pipe):
+    # If either prediction is nsfw, mark the frame as nsfw.
+    return "nsfw" if label_vit.lower() == "nsfw" or label_pipe.lower() == "nsfw" else "sfw"
 
-    extract_frames(video_path, output_dir, frame_interval)
+def cascade_candidates(vit_results, vit_scores, low=NSFW_CASCADE_LOW):
+    """Frames the second model must see: ViT calls them sfw, but not with NSFW probability below `low`."""
+    return [frame for frame, score in vit_scores.items()
+            if score >= low and vit_results[frame].lower() != "nsfw"]
 
-    print("Running ViT-based model on extracted frames...")
-    vit_results = process_images_vit(output_dir, batch_size=490)
-
-    empty_cuda()
+def classify_frames(frames, batch_size=None, ensemble=None, progress_done=0, progress_total=None):
+    """Runs the NSFW models over the frames and returns (labels, frames the second model saw).
 
-    print("Running pipeline-based classifier on extracted frames...")
-    pipeline_results = process_images_pipeline(output_dir, batch_size=490)
-    
-    # Combine the predictions for each frame
+    "or" runs both models on every frame and marks a frame nsfw if either says so. "cascade"
+    runs the ViT model on every frame and the pipeline classifier only on frames the ViT calls
+    sfw with an NSFW probability of at least NSFW_CASCADE_LOW. Each micro-batch is
+    preprocessed once and fed to both models before the next one is built. `frames` may be a
+    stream of (frame_id, frame) pairs. A caller classifying a video in several calls passes the
+    frames already done and the video's total for progress.
+    """
+    ensemble = ensemble or NSFW_ENSEMBLE
+    if isinstance(frames, dict):
+        progress_total = progress_total or len(frames)
+    logger.info(f"Running {ensemble} NSFW ensemble on {len(frames) if isinstance(frames, dict) else 'streamed'} frames...")
     combined_results = {}
-    for frame in vit_results.keys():
-        label_vit = vit_results.get(frame, "sfw").lower()
-        label_pipe = pipeline_results.get(frame, "sfw").lower()
-        
-        # If either prediction is nsfw, mark the frame as nsfw.
-        if label_vit == "nsfw" or label_pipe == "nsfw":
-            combined_results[frame] = "nsfw"
+    second_model_frames = 0
+
+    for batch_ids, batch, base in iter_batches(frames, batch_size):
+        verdict.check()
+        vit_labels, vit_scores = vit_forward(base, batch)
+        vit_results = dict(zip(batch_ids, vit_labels))
+        if ensemble == "cascade":
+            candidates = set(cascade_candidates(vit_results, dict(zip(batch_ids, vit_scores))))
+            rows = [j for j, frame_id in enumerate(batch_ids) if frame_id in candidates]
+        else:
+            rows = list(range(len(batch_ids)))
+
+        pipeline_results = {}
+        if rows:
+            pipe_labels, _ = pipeline_forward(base[rows], batch[rows])
+            pipeline_results = {batch_ids[j]: label for j, label in zip(rows, pipe_labels)}
+        second_model_frames += len(rows)
+
+        for frame_id in batch_ids:
+            combined_results[frame_id] = combine_labels(vit_results[frame_id], pipeline_results.get(frame_id, "sfw"))
+        logger.debug(f"Classified {len(combined_results)} frames ({len(rows)} of this batch through both models).")
+        emit("progress", stage="nsfw", done=progress_done + len(combined_results), total=progress_total)
+        del base, batch
+
+    if ensemble == "cascade":
+        logger.info(f"Cascade: {second_model_frames} of {len(combined_results)} frames went to the pipeline-based classifier.")
+    return combined_results, second_model_frames
+
+def nsfw_verdict(labels):
+    nsfw_frames = sum(label == "nsfw" for label in labels.values())
+    nsfw_percentage = nsfw_frames / len(labels) if labels else 0
+    return "NSFW (Not Safe For Work)" if nsfw_percentage >= NSFW_FRAME_RATIO else "SFW (Safe For Work)"
+
+def ensemble_parity(frames, frame_interval=1):
+    """Compares the cascade against the full OR-ensemble on the same frames, running each model once."""
+    sampled_frames = sample_frames(frames, frame_interval)
+    vit_results, vit_scores = process_images_vit(sampled_frames, return_scores=True)
+    pipeline_results = process_images_pipeline(sampled_frames)
+    candidates = set(cascade_candidates(vit_results, vit_scores))
+    or_labels, cascade_labels = {}, {}
+    for frame in sampled_frames:
+        or_labels[frame] = combine_labels(vit_results[frame], pipeline_results[frame])
+        cascade_labels[frame] = combine_labels(vit_results[frame], pipeline_results[frame] if frame in candidates else "sfw")
+    agreeing = sum(or_labels[frame] == cascade_labels[frame] for frame in sampled_frames)
+    return {
+        "frames": len(sampled_frames),
+        "frame_agreement": agreeing / len(sampled_frames) if sampled_frames else 1.0,
+        "second_model_frames": len(candidates),
+        "or_verdict": nsfw_verdict(or_labels),
+        "cascade_verdict": nsfw_verdict(cascade_labels),
+    }
+
+def reservoir_sample(frames, size, rng):
+    """A simple random sample of up to `size` (frame_id, frame) pairs from a stream, and the stream's length.
+
+    Only the sample is held while the stream is read, however long the video is.
+    """
+    sample, count = [], 0
+    for count, pair in enumerate(frames, 1):
+        if len(sample) < size:
+            sample.append(pair)
         else:
-            combined_results[frame] = "sfw"
+            slot = rng.randrange(count)
+            if slot < size:
+                sample[slot] = pair
+    return sample, count
+
+def early_exit_looks(sample, total, batch_size=NSFW_EARLY_EXIT_BATCH, min_frames=NSFW_EARLY_EXIT_MIN_FRAMES):
+    """Batch boundaries within the random sample at which the statistical test can run (not before min_frames, not at the end)."""
+    checkpoints = {min(end, sample) for end in range(batch_size, sample + batch_size, batch_size)}
+    return max(1, sum(1 for evaluated in checkpoints if min_frames <= evaluated < total))
+
+def _log_comb(n, k):
+    return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+
+def hypergeom_tail(count, total, nsfw_total, evaluated, upper):
+    """P(X >= count) if `upper` else P(X <= count), X the NSFW frames among `evaluated` drawn without replacement."""
+    lo, hi = max(0, evaluated - (total - nsfw_total)), min(evaluated, nsfw_total)
+    ks = range(max(lo, count), hi + 1) if upper else range(lo, min(hi, count) + 1)
+    log_all = _log_comb(total, evaluated)
+    return sum(math.exp(_log_comb(nsfw_total, k) + _log_comb(total - nsfw_total, evaluated - k) - log_all) for k in ks)
+
+def exact_exit_decision(nsfw_count, evaluated, total, ratio=NSFW_FRAME_RATIO):
+    """"nsfw"/"sfw" once the remaining frames can no longer move the ratio across the cutoff, else None."""
+    if nsfw_count >= ratio * total:
+        return "nsfw"
+    if nsfw_count + total - evaluated < ratio * total:
+        return "sfw"
+    return None
+
+def early_exit_decision(nsfw_count, evaluated, total, ratio=NSFW_FRAME_RATIO, level=NSFW_EARLY_EXIT_ALPHA):
+    """Returns "nsfw"/"sfw" once the verdict is settled for a random sample of `evaluated` frames, else None.
+
+    Past the exact bounds, an exact hypergeometric test at `level` decides: each wrong exit has
+    probability at most `level` whatever the video's true NSFW frame count.
+    """
+    decision = exact_exit_decision(nsfw_count, evaluated, total, ratio)
+    if decision is not None or evaluated < NSFW_EARLY_EXIT_MIN_FRAMES:
+        return decision
+    # The video is NSFW iff it has at least `cutoff` NSFW frames. The tails are monotone in that
+    # count, so testing against the count nearest the cutoff covers every count on that side.
+    cutoff = math.ceil(ratio * total)
+    if hypergeom_tail(nsfw_count, total, cutoff - 1, evaluated, upper=True) <= level:
+        return "nsfw"
+    if hypergeom_tail(nsfw_count, total, cutoff, evaluated, upper=False) <= level:
+        return "sfw"
+    return None
+
+def classify_early_exit(frames, reopen, batch_size=NSFW_EARLY_EXIT_BATCH, ensemble=None, rng=None, sample_size=NSFW_EARLY_EXIT_SAMPLE):
+    """Classifies a random sample of the frames first, stopping once the verdict is statistically settled.
+
+    `frames` is a stream of (frame_id, frame) pairs, read once to count the frames and keep a
+    simple random sample of `sample_size`. The sample is classified in a random order, batch by
+    batch, so every prefix is a random sample too; each statistical exit is an exact test at
+    NSFW_EARLY_EXIT_ALPHA / looks (Bonferroni), so the chance that any exit disagrees with the
+    full run is at most NSFW_EARLY_EXIT_ALPHA per video, wherever its NSFW frames are. If the
+    sample does not settle it, `reopen()` streams the frames again and the rest are classified
+    in decode order, where only exact-bound exits (which never change the verdict) apply.
+
+    Returns (labels, decision or None, frames through the second model, frames in the stream).
+    """
+    rng = rng or random.SystemRandom()
+    sample, total = reservoir_sample(frames, sample_size, rng)
+    rng.shuffle(sample)
+    level = NSFW_EARLY_EXIT_ALPHA / early_exit_looks(len(sample), total, batch_size)
+    labels = {}
+    counts = {"nsfw": 0, "second_model": 0}
+
+    def classify(batch):
+        batch_labels, batch_second = classify_frames(dict(batch), batch_size=len(batch), ensemble=ensemble,
+                                                     progress_done=len(labels), progress_total=total)
+        labels.update(batch_labels)
+        counts["second_model"] += batch_second
+        counts["nsfw"] += sum(label == "nsfw" for label in batch_labels.values())
+
+    for batch in chunked(sample, batch_size):
+        classify(batch)
+        decision = early_exit_decision(counts["nsfw"], len(labels), total, level=level)
+        if decision is not None:
+            logger.info(f"Early exit after {len(labels)} of {total} frames: {decision}")
+            return labels, decision, counts["second_model"], total
+    del sample
+
+    if len(labels) < total:
+        logger.info(f"Random sample of {len(labels)} frames left the verdict open; classifying the other {total - len(labels)}")
+        rest = ((frame_id, frame) for frame_id, frame in reopen() if frame_id not in labels)
+        for batch in chunked(rest, frame_batch_size()):
+            classify(batch)
+            decision = exact_exit_decision(counts["nsfw"], len(labels), total)
+            if decision is not None:
+                logger.info(f"Early exit after {len(labels)} of {total} frames: {decision}")
+                return labels, decision, counts["second_model"], total
+    return labels, None, counts["second_model"], total
+
+@span("nsfw")
+def main(video_path=None, frame_interval=1, frames=None, sampling=None, early_exit=None, ensemble=None, return_stats=False):
+    """Main function: Samples decoded frames, runs models, and determines NSFW status.
+
+    `frames` is the (N, H, W, 3) RGB array from `frame_decoder.decode_frames`, or a stream of
+    (index, frame) pairs from a decode shared with another detector; without it, `video_path` is
+    decoded here. Frames are classified as they arrive, one micro-batch at a time. Early exit may
+    decode `video_path` a second time. With `return_stats`, also returns how many frames the
+    models actually evaluated.
+    """
+    if isinstance(frames, np.ndarray):
+        logger.info("Starting NSFW detection on decoded frames")
+        decoded = frames
+        reopen = lambda: sample_stream(decoded, frame_interval)
+    else:
+        logger.info(f"Starting NSFW detection for video: {video_path}")
+        frames = stream_frames(video_path, frame_size()) if frames is None else frames
+        reopen = lambda: sample_stream(stream_frames(video_path, frame_size()), frame_interval)
+
+    early_exit = NSFW_EARLY_EXIT if early_exit is None else early_exit
+    sampling = sampling or NSFW_SAMPLING
+    if early_exit and sampling == "adaptive":
+        # Each representative stands in for a varying number of frames, which the early-exit bound does not model.
+        logger.info("Early exit classifies uniformly sampled frames; ignoring adaptive sampling.")
+        sampling = "uniform"
+
+    sampled_frames = sample_stream(frames, frame_interval)
+    stopped_early = False
+    if early_exit:
+        labels, decision, second_model_frames, sampled = classify_early_exit(sampled_frames, reopen, ensemble=ensemble)
+        stopped_early = decision is not None and len(labels) < sampled
+        evaluated = len(labels)
+        combined_results = labels
+    else:
+        assignment = {}
+        if sampling == "adaptive":
+            classified_frames = iter_representatives(sampled_frames, assignment)
+        else:
+            classified_frames = iter_uniform(sampled_frames, assignment)
+        labels, second_model_frames = classify_frames(classified_frames, ensemble=ensemble)
+        evaluated, sampled = len(labels), len(assignment)
+        # Unclassified frames take their representative's label.
+        combined_results = {frame: labels[rep] for frame, rep in assignment.items()}
 
     # Count the combined results
     counts = {"sfw": 0, "nsfw": 0}
@@ -166,16 +531,80 @@ def main(video_path, frame_interval=1):
         elif label == "nsfw":
             counts["nsfw"] += 1
 
-    print("Counts:", counts)
+    logger.info(f"Counts: {counts}")
 
-    total_frames = counts["sfw"] + counts["nsfw"]
-    nsfw_percentage = counts["nsfw"] / total_frames if total_frames > 0 else 0
-
-    if nsfw_percentage >= 0.05:
-        final_decision = "NSFW (Not Safe For Work)"
+    if stopped_early:
+        final_decision = "NSFW (Not Safe For Work)" if decision == "nsfw" else "SFW (Safe For Work)"
     else:
-        final_decision = "SFW (Safe For Work)"
+        final_decision = nsfw_verdict(combined_results)
+
+    logger.info(f"Final Decision: {final_decision}")
+    empty_cuda()
+    if return_stats:
+        return final_decision, {
+            "frames_evaluated": evaluated,
+            "frames_sampled": sampled,
+            "second_model_frames": second_model_frames,
+            "nsfw_frames": counts["nsfw"],
+            "early_exit": stopped_early,
+        }
+    return final_decision
+
+@span("nsfw_batch")
+def classify_videos(videos, frame_interval=1, sampling=None, ensemble=None):
+    """Classifies several videos in shared micro-batches; returns one (decision, stats) per video.
+
+    `videos` holds (N, H, W, 3) arrays or (index, frame) streams, read one after another; frames
+    are keyed by (video, frame index), so a micro-batch runs on from one video into the next and
+    every batch is full until the last one. Early exit stops per video, so it is not applied.
+    """
+    sampling = sampling or NSFW_SAMPLING
+    assignments = [{} for _ in videos]
+
+    def pooled():
+        for video, frames in enumerate(videos):
+            sampled_frames = sample_stream(frames, frame_interval)
+            assignment = assignments[video]
+            if sampling == "adaptive":
+                sampled_frames = iter_representatives(sampled_frames, assignment)
+            else:
+                sampled_frames = iter_uniform(sampled_frames, assignment)
+            for frame_id, frame in sampled_frames:
+                yield (video, frame_id), frame
 
-    print("Final Decision:", final_decision)
+    labels, second_model_frames = classify_frames(pooled(), ensemble=ensemble)
     empty_cuda()
-    return final_decision
\ No newline at end of file
+    logger.info(f"Classified {len(labels)} frames from {len(videos)} videos ({second_model_frames} through the second model).")
+    results = []
+    for video, assignment in enumerate(assignments):
+        combined_results = {frame: labels[(video, rep)] for frame, rep in assignment.items()}
+        results.append((nsfw_verdict(combined_results), {
+            "frames_evaluated": len(set(assignment.values())),
+            "frames_sampled": len(assignment),
+            # Shared batches mix videos, so the second model's frames are only counted for the whole batch.
+            "second_model_frames": None,
+            "nsfw_frames": sum(label == "nsfw" for label in combined_results.values()),
+            "early_exit": False,
+        }))
+    return results
+
+if __name__ == "__main__":
+    # Parity checks over the bundled sample reels:
+    #   python nsfw_detector.py sampling [dirs...]   uniform vs adaptive verdicts
+    #   python nsfw_detector.py cascade [dirs...]    cascade vs OR-ensemble labels and verdicts
+    import sys
+    check = sys.argv[1] if len(sys.argv) > 1 else "sampling"
+    video_dirs = sys.argv[2:] or ["Sample_Test_Reels", "All Sample VIdeos"]
+    for video_dir in video_dirs:
+        for name in sorted(os.listdir(video_dir)):
+            decoded, _ = decode_frames(os.path.join(video_dir, name), frame_size())
+            if check == "cascade":
+                parity = ensemble_parity(decoded)
+                match = parity["or_verdict"] == parity["cascade_verdict"]
+                print(f"{'MATCH' if match else 'MISMATCH'}\t{name}\tframe_agreement={parity['frame_agreement']:.4f}"
+                      f"\tsecond_model={parity['second_model_frames']}/{parity['frames']}"
+                      f"\tor={parity['or_verdict']}\tcascade={parity['cascade_verdict']}")
+            else:
+                uniform = main(frames=decoded, sampling="uniform")
+                adaptive = main(frames=decoded, sampling="adaptive")
+                print(f"{'MATCH' if uniform == adaptive else 'MISMATCH'}\t{name}\tuniform={uniform}\tadaptive={adaptive}")
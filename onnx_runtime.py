@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import time
+from types import SimpleNamespace
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+# "torch" serves the eager PyTorch models; "onnx" serves exported ONNX Runtime sessions on CPU.
+INFERENCE_RUNTIME = os.environ.get("INFERENCE_RUNTIME", "torch")
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "./onnx_models")
+# Serve the dynamically int8-quantized export instead of the fp32 one.
+ONNX_QUANTIZED = os.environ.get("ONNX_QUANTIZED", "1") == "1"
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", 0))  # 0 lets ONNX Runtime pick
+
+def onnx_path(name, quantized=ONNX_QUANTIZED):
+    return os.path.join(ONNX_MODEL_DIR, f"{name}.int8.onnx" if quantized else f"{name}.onnx")
+
+def violence_onnx_name(model_path):
+    # One export per checkpoint, so hot-reloading a checkpoint picks up its own export.
+    return f"violence_{os.path.splitext(os.path.basename(model_path))[0]}"
+
+class OnnxModel:
+    """Stands in for a PyTorch classifier: takes a pixel tensor and returns torch logits.
+
+    With a HuggingFace `config`, the call mirrors `model(pixel_values=...).logits`; without one
+    it returns the logits tensor directly, like VideoClassifier.
+    """
+
+    def __init__(self, path, config=None):
+        import onnxruntime as ort
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"ONNX model not found: {path} (run `python onnx_runtime.py export`)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.config = config
+        self.device = torch.device("cpu")
+
+    def eval(self):
+        return self
+
+    def __call__(self, x=None, pixel_values=None):
+        inputs = pixel_values if pixel_values is not None else x
+        logits = torch.from_numpy(self.session.run(None, {self.input_name: inputs.detach().cpu().numpy()})[0])
+        return SimpleNamespace(logits=logits) if self.config is not None else logits
+
+class _LogitsOnly(nn.Module):
+    # HuggingFace models return a ModelOutput; export just the logits tensor.
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+def _export(module, dummy, name, input_name, dynamic_axes):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    os.makedirs(ONNX_MODEL_DIR, exist_ok=True)
+    fp32_path, int8_path = onnx_path(name, quantized=False), onnx_path(name, quantized=True)
+    logger.info(f"Exporting {name} to {fp32_path}")
+    module = module.cpu().eval()
+    torch.onnx.export(
+        module, (dummy,), fp32_path,
+        input_names=[input_name], output_names=["logits"],
+        dynamic_axes=dynamic_axes, opset_version=17,
+    )
+    logger.info(f"Quantizing {name} to {int8_path}")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return fp32_path, int8_path
+
+def export_models(violence_model_path=None):
+    """Exports the ViT, pipeline and violence classifiers to fp32 and dynamic-int8 ONNX files."""
+    import nsfw_detector
+    import violence_detector
+
+    vit_processor, vit = nsfw_detector.load_vit(nsfw_detector.VIT_MODEL_NAME, runtime="torch")
+    pipe = nsfw_detector.load_pipeline(nsfw_detector.PIPELINE_MODEL_NAME, runtime="torch")
+    image_axes = {"pixel_values": {0: "batch"}, "logits": {0: "batch"}}
+    # Each ViT is traced at its own input size (384x384 for the ViT detector); a mismatch fails the export.
+    _export(_LogitsOnly(vit), torch.zeros(1, 3, *nsfw_detector.input_hw(vit_processor, vit)), "nsfw_vit", "pixel_values", image_axes)
+    _export(_LogitsOnly(pipe.model), torch.zeros(1, 3, *nsfw_detector.input_hw(pipe.image_processor, pipe.model)), "nsfw_pipeline",
+            "pixel_values", image_axes)
+
+    violence_model_path = violence_model_path or violence_detector.current_model_path()
+    classifier = violence_detector.load_model(violence_model_path, runtime="torch")
+    _export(classifier, torch.zeros(1, 30, 3, 224, 224), violence_onnx_name(violence_model_path), "frames",
+            {"frames": {0: "batch", 1: "frames"}, "logits": {0: "batch"}})
+
+def _timed(fn, *args):
+    start = time.monotonic()
+    result = fn(*args)
+    return result, time.monotonic() - start
+
+def parity(video_dirs, frame_interval=5):
+    """Compares ONNX Runtime labels with the PyTorch models on the sample reels and reports frames per second."""
+    import numpy as np
+    import nsfw_detector
+    import violence_detector
+    from frame_decoder import decode_frames
+
+    runtimes = {}
+    for runtime in ("torch", "onnx"):
+        runtimes[runtime] = {
+            "vit": nsfw_detector.load_vit(nsfw_detector.VIT_MODEL_NAME, runtime=runtime),
+            "pipe": nsfw_detector.load_pipeline(nsfw_detector.PIPELINE_MODEL_NAME, runtime=runtime),
+            "violence": violence_detector.load_model(violence_detector.current_model_path(), runtime=runtime),
+        }
+
+    totals = {runtime: {"frames": 0, "vit_s": 0.0, "pipe_s": 0.0, "violence_s": 0.0} for runtime in runtimes}
+    agreement = {"vit": [0, 0], "pipe": [0, 0], "violence": [0, 0]}
+    for video_dir in video_dirs:
+        for name in sorted(os.listdir(video_dir)):
+            frames, _ = decode_frames(os.path.join(video_dir, name), nsfw_detector.frame_size())
+            sampled = frames[::frame_interval]
+            clip = violence_detector.sample_frames(frames).unsqueeze(0)
+            labels = {}
+            for runtime, models in runtimes.items():
+                vit_labels, pipe_labels = [], []
+                for i in range(0, len(sampled), 32):
+                    batch = sampled[i:i + 32]
+                    base = nsfw_detector.to_base_tensor(batch, torch.device("cpu"))
+                    (vit_batch, _), vit_s = _timed(nsfw_detector.vit_forward, base, batch, models["vit"])
+                    (pipe_batch, _), pipe_s = _timed(nsfw_detector.pipeline_forward, base, batch, models["pipe"])
+                    vit_labels += vit_batch
+                    pipe_labels += pipe_batch
+                    totals[runtime]["vit_s"] += vit_s
+                    totals[runtime]["pipe_s"] += pipe_s
+                with torch.no_grad():
+                    outputs, violence_s = _timed(models["violence"], clip)
+                totals[runtime]["violence_s"] += violence_s
+                totals[runtime]["frames"] += len(sampled)
+                labels[runtime] = (vit_labels, pipe_labels, int(torch.argmax(outputs, dim=1).item()))
+
+            torch_labels, onnx_labels = labels["torch"], labels["onnx"]
+            for key, index in (("vit", 0), ("pipe", 1)):
+                agreement[key][0] += int(np.sum(np.array(torch_labels[index]) == np.array(onnx_labels[index])))
+                agreement[key][1] += len(torch_labels[index])
+            agreement["violence"][0] += int(torch_labels[2] == onnx_labels[2])
+            agreement["violence"][1] += 1
+            print(f"{name}\tvit={agreement['vit'][0]}/{agreement['vit'][1]}\tpipe={agreement['pipe'][0]}/{agreement['pipe'][1]}"
+                  f"\tviolence_match={torch_labels[2] == onnx_labels[2]}")
+
+    report = {
+        "quantized": ONNX_QUANTIZED,
+        "agreement": {key: matched / total if total else 1.0 for key, (matched, total) in agreement.items()},
+        "fps": {
+            runtime: {
+                "vit": t["frames"] / t["vit_s"] if t["vit_s"] else None,
+                "pipe": t["frames"] / t["pipe_s"] if t["pipe_s"] else None,
+                "violence_clips_per_s": agreement["violence"][1] / t["violence_s"] if t["violence_s"] else None,
+            }
+            for runtime, t in totals.items()
+        },
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+if __name__ == "__main__":
+    #   python onnx_runtime.py export [violence_checkpoint]
+    #   python onnx_runtime.py parity [dirs...]
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else "parity"
+    if command == "export":
+        export_models(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        parity(sys.argv[2:] or ["Sample_Test_Reels"])
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "./result_cache.sqlite3")
+# Shared by every cache table in RESULT_CACHE_PATH, not per table.
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_key(*parts):
+    """Builds a stable cache key from JSON-serializable parts."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """Content-addressed JSON store in SQLite with a total size limit and least-recently-used eviction.
+
+    Each cache is one table; all tables in the same file share `max_bytes` and are evicted together.
+    """
+
+    def __init__(self, table, path=RESULT_CACHE_PATH, max_bytes=RESULT_CACHE_MAX_BYTES, enabled=RESULT_CACHE_ENABLED):
+        self.table = table
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Opened on first use so importing the module never touches the disk.
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        logger.info(f"Cache hit in {self.table}: {key[:12]}")
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        encoded = json.dumps(value)
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, encoded, len(encoded), time.time()),
+            )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        # Least recently used entries go first, whichever cache they belong to.
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        entries = " UNION ALL ".join(f"SELECT '{table}' AS cache, key, size, last_access FROM {table}" for table in tables)
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM ({entries})").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for table, key, size in conn.execute(f"SELECT cache, key, size FROM ({entries}) ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+            total -= size
@@ -13,22 +13,24 @@ export default function ResultsDisplay({ results }) {
   return (
     <div className="space-y-6">
       {/* Transcript */}
-      <ResultSection title="Transcript (Urdu)" content={transcript} type="text" />
+      {transcript !== undefined && (
+        <ResultSection title="Transcript (Urdu)" content={transcript} type="text" />
+      )}
 
       {/* Tables */}
-      {abusive_table[0][1] !== "Not analyzed" && (
+      {abusive_table && abusive_table[0][1] !== "Not analyzed" && (
         <ResultSection title="Abusive Content Analysis" content={abusive_table} type="table" />
       )}
-      {violent_table[0][1] !== "Not analyzed" && (
+      {violent_table && violent_table[0][1] !== "Not analyzed" && (
         <ResultSection title="Violent Content Analysis" content={violent_table} type="table" />
       )}
-      {nsfw_audio_table[0][1] !== "Not analyzed" && (
+      {nsfw_audio_table && nsfw_audio_table[0][1] !== "Not analyzed" && (
         <ResultSection title="NSFW Content Analysis" content={nsfw_audio_table} type="table" />
       )}
-      {political_table[0][1] !== "Not analyzed" && (
+      {political_table && political_table[0][1] !== "Not analyzed" && (
         <ResultSection title="Political Content Analysis" content={political_table} type="table" />
       )}
-      {religious_table[0][1] !== "Not analyzed" && (
+      {religious_table && religious_table[0][1] !== "Not analyzed" && (
         <ResultSection title="Religious Content Analysis" content={religious_table} type="table" />
       )}
 
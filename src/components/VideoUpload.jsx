@@ -1,11 +1,11 @@
 import { useCallback, useState, useEffect } from 'react';
 import { useDropzone } from 'react-dropzone';
-import axios from 'axios';
 import toast from 'react-hot-toast';
 import { CloudArrowUpIcon } from '@heroicons/react/24/outline';
 
 export default function VideoUpload({ apiKey, options, setResults, isAnalyzing, setIsAnalyzing }) {
   const [previewUrl, setPreviewUrl] = useState(null);
+  const [progress, setProgress] = useState('');
   // const MAX_FILE_SIZE = 20 * 1024 * 1024; // 100MB in bytes
   const MAX_FILE_SIZE = 50 * 1024 * 1024; // 50MB in bytes
   
@@ -63,21 +63,52 @@ export default function VideoUpload({ apiKey, options, setResults, isAnalyzing,
     formData.append('detect_religious', options.detectReligious);
     
     setIsAnalyzing(true);
+    setResults({});
+    setProgress('');
     
     try {
-      const response = await axios.post('https://civil-daring-halibut.ngrok-free.app/analyze', formData, {
-      // const response = await axios.post('http://0.0.0.0:8000/analyze', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
+      // Results arrive as Server-Sent Events, each one filling in part of the results.
+      const response = await fetch('https://civil-daring-halibut.ngrok-free.app/analyze/stream', {
+      // const response = await fetch('http://0.0.0.0:8000/analyze/stream', {
+        method: 'POST',
+        body: formData,
       });
-      setResults(response.data);
+      if (!response.ok || !response.body) {
+        throw new Error(`Request failed with status ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let failed = null;
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop();
+        for (const message of messages) {
+          const event = message.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(message.match(/^data: (.*)$/m)?.[1] ?? '{}');
+          if (event === 'progress') {
+            if (data.done !== undefined) {
+              setProgress(`${data.stage}: ${data.done}${data.total ? ` of ${data.total}` : ''}`);
+            }
+          } else if (event === 'error') {
+            failed = data.error;
+          } else {
+            setResults((previous) => ({ ...previous, ...data }));
+          }
+        }
+      }
+      if (failed) throw new Error(failed);
       toast.success('Analysis completed successfully!');
     } catch (error) {
       console.error('Analysis failed:', error);
       toast.error('Analysis failed. Please try again.');
     } finally {
       setIsAnalyzing(false);
+      setProgress('');
     }
   }, [apiKey, options, setResults, setIsAnalyzing, previewUrl]);
 
@@ -101,7 +132,7 @@ export default function VideoUpload({ apiKey, options, setResults, isAnalyzing,
         <input {...getInputProps()} />
         <CloudArrowUpIcon className="h-12 w-12 mx-auto text-gray-400" />
         <p className="mt-4 text-lg text-gray-600">
-          {isAnalyzing ? 'Analyzing video...' : isDragActive ? 'Drop the video here' : 'Drag & drop a video, or click to select'}
+          {isAnalyzing ? `Analyzing video...${progress ? ` (${progress})` : ''}` : isDragActive ? 'Drop the video here' : 'Drag & drop a video, or click to select'}
         </p>
         <p className="mt-2 text-sm text-gray-500">Supported formats: MP4, AVI, MOV (Max size: {MAX_FILE_SIZE / (1024 * 1024)}MB)</p>
       </div>
@@ -0,0 +1,111 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from telemetry import in_context
+
+logger = logging.getLogger(__name__)
+
+class StageGraph:
+    """Runs named stages on a thread pool, each as soon as every stage it depends on has finished.
+
+    A stage is called with its dependencies' results as positional arguments, in the order they
+    were listed. If a stage raises, nothing new is started, running stages are allowed to finish
+    and the first exception is re-raised from `run`. If the `cancel` event passed to `run` is set,
+    `run` returns at once with the results so far; running stages are left to stop on their own,
+    and `cleanup` runs only once the last of them has.
+    """
+
+    def __init__(self):
+        self._stages = {}
+
+    def add(self, name, fn, deps=()):
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            # Requiring dependencies to be added first also rules out cycles.
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {', '.join(missing)}")
+        self._stages[name] = (fn, tuple(deps))
+
+    def run(self, outputs=None, on_done=None, cancel=None, cleanup=None):
+        """Runs every stage and returns {name: result} for `outputs` (default: all stages).
+
+        Results not in `outputs` are dropped once all their dependents have finished, so large
+        intermediates such as decoded frames are freed as early as possible. `on_done(name, result)`
+        is called on the calling thread as each stage succeeds. `cleanup()` is called once no stage
+        is running, e.g. to delete files the stages read: before `run` returns, or after a
+        cancellation on the thread of the last stage to stop.
+        """
+        outputs = set(self._stages if outputs is None else outputs)
+        dependents = {name: 0 for name in self._stages}
+        for _, deps in self._stages.values():
+            for dep in deps:
+                dependents[dep] += 1
+        results, done, running = {}, set(), {}
+        error = None
+
+        executor = ThreadPoolExecutor(max_workers=max(1, len(self._stages)), thread_name_prefix="stage")
+        try:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    logger.info(f"Stage graph cancelled with {len(running)} stages still running")
+                    break
+                if error is None:
+                    for name, (fn, deps) in self._stages.items():
+                        if name not in done and name not in running.values() and all(dep in done for dep in deps):
+                            logger.debug(f"Starting stage {name}")
+                            future = executor.submit(in_context(fn), *(results[dep] for dep in deps))
+                            running[future] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        if cancel is not None and cancel.is_set():
+                            logger.debug(f"Stage {name} stopped after cancellation: {e}")
+                        else:
+                            logger.error(f"Stage {name} failed: {e}")
+                            error = error or e
+                        continue
+                    done.add(name)
+                    logger.debug(f"Finished stage {name}")
+                    if on_done is not None:
+                        on_done(name, results[name])
+                    for dep in self._stages[name][1]:
+                        dependents[dep] -= 1
+                        if dependents[dep] == 0 and dep not in outputs:
+                            results.pop(dep, None)
+        finally:
+            cancelled = cancel is not None and cancel.is_set()
+            executor.shutdown(wait=not cancelled, cancel_futures=True)
+            if cleanup is not None:
+                self._cleanup_when_drained(list(running) if cancelled else [], cleanup)
+
+        if error is not None:
+            raise error
+        return {name: results[name] for name in outputs if name in results}
+
+    @staticmethod
+    def _cleanup_when_drained(futures, cleanup):
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def run_cleanup():
+            try:
+                cleanup()
+            except Exception as e:
+                logger.error(f"Stage graph cleanup failed: {e}")
+
+        def stage_stopped(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                run_cleanup()
+
+        if not futures:
+            run_cleanup()
+        for future in futures:
+            # Runs at once for stages that already stopped, else on the stage's thread as it stops.
+            future.add_done_callback(stage_stopped)
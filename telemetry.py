@@ -0,0 +1,210 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "text" for human-readable lines, "json" for one JSON object per line.
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class TextFormatter(logging.Formatter):
+    """Plain log lines with any structured fields appended as key=value pairs."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not any(getattr(handler, "_moderation", False) for handler in root.handlers):
+        handler = logging.StreamHandler()
+        handler._moderation = True
+        handler.setFormatter(JsonFormatter() if fmt == "json" else
+                             TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        root.addHandler(handler)
+
+configure_logging()
+logger = logging.getLogger("telemetry")
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def samples(self):
+        """Yields (suffix, labels, value) triples for the exposition."""
+        raise NotImplementedError
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_label_text(labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield "", dict(key), value
+
+class Gauge(Metric):
+    """A settable gauge, or one read from `callback` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback=None):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        if self.callback is not None:
+            yield "", {}, self.callback()
+            return
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield "", dict(key), value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in series.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                yield "_bucket", {**labels, "le": bound}, cumulative
+            yield "_bucket", {**labels, "le": "+Inf"}, values[-1]
+            yield "_sum", labels, round(values[-2], 6)
+            yield "_count", labels, values[-1]
+
+METRICS = []
+STAGE_LATENCY = Histogram("moderation_stage_latency_seconds", "Wall time of each pipeline stage.")
+MODEL_LOAD_SECONDS = Gauge("moderation_model_load_seconds", "Time the most recent load of each model took.")
+GEMINI_TOKENS = Counter("moderation_gemini_tokens_total", "Gemini tokens used, by direction.")
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+_timings = contextvars.ContextVar("timings", default=None)
+_timings_lock = threading.Lock()
+
+@contextmanager
+def collect_timings():
+    """Collects the seconds spent per stage by every span run in this context."""
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+@contextmanager
+def span(stage):
+    """Times a block as `stage`: observed in the latency histogram and added to the request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            with _timings_lock:
+                timings[stage] = round(timings.get(stage, 0.0) + elapsed, 4)
+        logger.debug("span finished", extra={"fields": {"stage": stage, "seconds": round(elapsed, 4)}})
+
+_events = contextvars.ContextVar("events", default=None)
+
+@contextmanager
+def stream_events(sink):
+    """Sends every event emitted in this context, including on in_context threads, to `sink(event, data)`."""
+    token = _events.set(sink)
+    try:
+        yield
+    finally:
+        _events.reset(token)
+
+def emit(event, **data):
+    """Reports a partial result or progress to the request's event stream, if it has one."""
+    sink = _events.get()
+    if sink is not None:
+        sink(event, data)
+
+def in_context(fn):
+    """Binds `fn` to a copy of the caller's context, so spans it runs on a worker thread reach the caller's timings.
+
+    Call it once per submission; a context can only be entered by one thread at a time.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
@@ -0,0 +1,80 @@
+import os
+from gemini_client import estimate_tokens
+
+# Transcripts estimated above this many tokens are analyzed in chunks; the price doubles past 128k input tokens.
+GEMINI_CHUNK_THRESHOLD = int(os.environ.get("GEMINI_CHUNK_THRESHOLD", 100_000))
+# Target size of each chunk; smaller chunks finish sooner since they run in parallel.
+GEMINI_CHUNK_TOKENS = int(os.environ.get("GEMINI_CHUNK_TOKENS", 30_000))
+
+SEVERITY_RANKS = {"none": 0, "low": 1, "mild": 1, "moderate": 2, "medium": 2, "high": 3, "severe": 3}
+
+def _split_long_text(text, max_tokens):
+    # A single segment over the limit is split on word boundaries instead.
+    pieces, current = [], []
+    for word in text.split():
+        if current and estimate_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def split_transcript(text, segments=None, max_tokens=GEMINI_CHUNK_TOKENS, threshold=GEMINI_CHUNK_THRESHOLD):
+    """Splits a transcript into chunks of at most ~max_tokens on Whisper segment boundaries.
+
+    Returns [text] unchanged when it is under `threshold`. Without segments (e.g. a backend that
+    returns none), words stand in for them.
+    """
+    if estimate_tokens(text) <= threshold:
+        return [text]
+    pieces = [segment["text"].strip() for segment in segments] if segments else text.split()
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        if not piece:
+            continue
+        tokens = estimate_tokens(piece)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_long_text(piece, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def severity_rank(severity):
+    words = str(severity).lower().replace("-", " ").replace(",", " ").split()
+    return max((SEVERITY_RANKS[word] for word in words if word in SEVERITY_RANKS), default=0)
+
+def _unique(values):
+    seen, merged = set(), []
+    for value in values:
+        key = str(value).strip().lower()
+        if key and key not in seen:
+            seen.add(key)
+            merged.append(value)
+    return merged
+
+def merge_results(results):
+    """Merges per-chunk result dicts into one, independent of which chunk finished first.
+
+    A category is flagged if any chunk is; tags and reasons are concatenated in chunk order
+    without duplicates; severity is the highest one reported (the earliest chunk wins ties).
+    Any other keys keep the first chunk's value.
+    """
+    merged = dict(results[0])
+    merged["is_flagged"] = any(bool(result.get("is_flagged")) for result in results)
+    for key in ("tags", "reasons"):
+        merged[key] = _unique(value for result in results for value in (result.get(key) or []))
+    severities = [result.get("severity") for result in results if result.get("severity") is not None]
+    if severities:
+        # max() keeps the first of equal ranks, so ties resolve to the earliest chunk.
+        merged["severity"] = max(severities, key=severity_rank)
+    return merged
@@ -0,0 +1,101 @@
+import contextvars
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from transcript_chunks import severity_rank
+
+logger = logging.getLogger(__name__)
+
+# Lowest Gemini severity that blocks on its own in verdict-only mode; "low" blocks on any flag.
+VERDICT_SEVERITY = os.environ.get("VERDICT_SEVERITY", "high")
+
+class VerdictReached(Exception):
+    """Raised inside a stage once another stage has already decided the verdict."""
+
+class Verdict:
+    """The first decisive flag of a verdict-only request; later stages stop once it is set."""
+
+    def __init__(self, reached=None):
+        # A detector worker process passes a flag mapped from the web process instead of an Event.
+        self.reached = threading.Event() if reached is None else reached
+        self.stage = None
+        self.reason = ""
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def decide(self, stage, reason):
+        with self._lock:
+            if self.reached.is_set():
+                return
+            self.stage, self.reason = stage, reason
+            self.reached.set()
+            listeners, self._listeners = self._listeners, []
+        logger.info(f"Verdict reached by {stage}: {reason}")
+        for listener in listeners:
+            listener()
+
+    def on_reached(self, callback):
+        """Calls `callback()` once the verdict is decided, right away if it already is."""
+        with self._lock:
+            if not self.reached.is_set():
+                self._listeners.append(callback)
+                return
+        callback()
+
+    def as_dict(self):
+        if self.reached.is_set():
+            return {"verdict": "block", "stage": self.stage, "reason": self.reason}
+        return {"verdict": "allow", "stage": None, "reason": ""}
+
+_verdict = contextvars.ContextVar("verdict", default=None)
+
+@contextmanager
+def verdict_scope(reached=None):
+    """Makes stages run in this context (including on in_context threads) stop at the first decisive flag."""
+    verdict = Verdict(reached)
+    token = _verdict.set(verdict)
+    try:
+        yield verdict
+    finally:
+        _verdict.reset(token)
+
+def active():
+    return _verdict.get() is not None
+
+def reached():
+    verdict = _verdict.get()
+    return verdict is not None and verdict.reached.is_set()
+
+def on_reached(callback):
+    """Calls `callback()` when this request's verdict is decided; does nothing outside verdict-only mode."""
+    verdict = _verdict.get()
+    if verdict is not None:
+        verdict.on_reached(callback)
+
+def check():
+    """Raises VerdictReached if this request's verdict is already decided."""
+    verdict = _verdict.get()
+    if verdict is not None and verdict.reached.is_set():
+        raise VerdictReached(verdict.stage)
+
+def consider_gemini(name, data):
+    verdict = _verdict.get()
+    if verdict is None or not data or not data.get("is_flagged"):
+        return
+    severity = data.get("severity")
+    if severity_rank(severity) >= severity_rank(VERDICT_SEVERITY):
+        verdict.decide(f"gemini_{name}", f"{name} content flagged with severity {severity}")
+
+def consider_nsfw(nsfw_result):
+    verdict = _verdict.get()
+    decision, stats = nsfw_result
+    if verdict is not None and decision.startswith("NSFW"):
+        verdict.decide("nsfw", f"{stats['nsfw_frames']} NSFW frames after {stats['frames_evaluated']} evaluated")
+
+def consider_violence(violence_result):
+    verdict = _verdict.get()
+    label, windows = violence_result
+    if verdict is not None and label == "Violence":
+        peak = max((window["violence"] for window in windows), default=None) if windows else None
+        verdict.decide("violence", "violence model verdict" + (f" (peak window score {peak:.2f})" if peak is not None else ""))
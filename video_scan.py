@@ -0,0 +1,62 @@
+import logging
+from frame_decoder import iter_frames, to_rgb, video_fps
+import nsfw_detector
+import violence_detector
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+def tapped_frames(video_path, samples):
+    """Decodes `video_path` once, yielding (index, RGB frame at nsfw_detector.frame_size()) pairs.
+
+    Each decoded frame is offered to `samples` (a violence ClipSamples, or None) on the way, so
+    both detectors read the same decode and only the current frame plus what they keep is held.
+    """
+    output_size = nsfw_detector.frame_size()
+    for index, frame in iter_frames(video_path):
+        if samples is not None:
+            samples.add(index, frame)
+        yield index, to_rgb(frame, output_size)
+
+@span("video_scan")
+def scan_video(video_path, nsfw=None, violence=None):
+    """Runs the requested frame detectors over one decode of the video.
+
+    `nsfw` and `violence` are the options for each detector's main() (an empty dict runs it
+    with defaults, None skips it). Returns {"nsfw": (decision, stats), "violence": (label, windows)},
+    with None for a skipped detector.
+    """
+    samples = violence_detector.ClipSamples(violence.get("windowed")) if violence is not None else None
+    results = {"nsfw": None, "violence": None}
+    if nsfw is not None:
+        results["nsfw"] = nsfw_detector.main(video_path=video_path, frames=tapped_frames(video_path, samples),
+                                             return_stats=True, **nsfw)
+    elif samples is not None:
+        samples = violence_detector.collect_samples(video_path, samples.windowed)
+    if samples is not None:
+        results["violence"] = violence_detector.main(samples=samples, fps=video_fps(video_path), return_windows=True, **violence)
+    return results
+
+@span("video_scan_batch")
+def scan_videos(video_paths, nsfw=None, violence=None):
+    """Batch version of scan_video: frames of all videos share NSFW micro-batches and violence clips share forward passes.
+
+    Videos are decoded one after another as the NSFW batches consume them, so only one is being
+    decoded at a time. Returns one scan_video-style result per path, in order.
+    """
+    windowed = (violence or {}).get("windowed")
+    samples = [violence_detector.ClipSamples(windowed) if violence is not None else None for _ in video_paths]
+    results = [{"nsfw": None, "violence": None} for _ in video_paths]
+    if nsfw is not None:
+        streams = [tapped_frames(video_path, video_samples) for video_path, video_samples in zip(video_paths, samples)]
+        for result, nsfw_result in zip(results, nsfw_detector.classify_videos(streams, **nsfw)):
+            result["nsfw"] = nsfw_result
+    elif violence is not None:
+        samples = [violence_detector.collect_samples(video_path, windowed) for video_path in video_paths]
+    if violence is not None:
+        logger.info(f"Scoring violence for {len(video_paths)} videos")
+        options = {key: value for key, value in violence.items() if key != "windowed"}
+        videos = [(video_samples, video_fps(video_path)) for video_path, video_samples in zip(video_paths, samples)]
+        for result, violence_result in zip(results, violence_detector.predict_batch(videos, windowed=windowed, **options)):
+            result["violence"] = violence_result
+    return results
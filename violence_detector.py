@@ -1,10 +1,31 @@
+import logging
 import torch
 import torchvision.transforms as transforms
-import imageio
 import os
 import numpy as np
 import torchvision.models as models
 import torch.nn as nn
+from frame_decoder import iter_frames, to_rgb, video_fps
+from model_registry import registry
+from onnx_runtime import OnnxModel, onnx_path, violence_onnx_name, INFERENCE_RUNTIME
+from telemetry import span, emit
+import verdict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_PATH = os.environ.get("VIOLENCE_MODEL_PATH", './violence/code/runs/20250305_175848/video_classifier_epoch_2.pth')
+# Directory hot reloads may load checkpoints from; paths outside it are refused.
+VIOLENCE_CHECKPOINT_ROOT = os.environ.get("VIOLENCE_CHECKPOINT_ROOT", './violence/code/runs')
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# Windowed mode scores the whole video in overlapping 30-frame clips instead of only its first ~15 seconds.
+VIOLENCE_WINDOWED = os.environ.get("VIOLENCE_WINDOWED", "0") == "1"
+# Decoded frames between window starts; 225 overlaps each 435-frame clip span by roughly half.
+VIOLENCE_WINDOW_STRIDE = int(os.environ.get("VIOLENCE_WINDOW_STRIDE", 225))
+# Latency budget: above this many windows, starts are spread uniformly over the video instead.
+VIOLENCE_MAX_WINDOWS = int(os.environ.get("VIOLENCE_MAX_WINDOWS", 32))
+VIOLENCE_WINDOW_BATCH = int(os.environ.get("VIOLENCE_WINDOW_BATCH", 4))
+VIOLENCE_WINDOW_THRESHOLD = float(os.environ.get("VIOLENCE_WINDOW_THRESHOLD", 0.5))
 
 class CFG:
     epochs = 10
@@ -13,9 +34,9 @@ class CFG:
 
 # Define PyTorch EfficientNet Model
 class VideoClassifier(nn.Module):
-    def __init__(self, num_classes=len(CFG.classes)):
+    def __init__(self, num_classes=len(CFG.classes), pretrained=True):
         super(VideoClassifier, self).__init__()
-        self.efficient_net = models.efficientnet_b0(pretrained=True)
+        self.efficient_net = models.efficientnet_b0(pretrained=pretrained)
         self.efficient_net.classifier[1] = nn.Linear(self.efficient_net.classifier[1].in_features, num_classes)
     
     def forward(self, x):
@@ -34,35 +55,244 @@ def format_frames(frame, output_size=(224, 224)):
     ])
     return transform(frame)
 
+class ClipSamples:
+    """The decoded frames violence scoring reads, kept while a video streams past.
+
+    Clips take every `frame_step`-th frame, so only those are kept, at 224x224; without windowing
+    only the first `n_frames` of them are. `num_frames` counts every frame seen.
+    """
+
+    def __init__(self, windowed=None, n_frames=30, frame_step=15, output_size=(224, 224)):
+        self.windowed = VIOLENCE_WINDOWED if windowed is None else windowed
+        self.n_frames, self.frame_step, self.output_size = n_frames, frame_step, output_size
+        self.frames = []
+        self.num_frames = 0
+
+    def add(self, index, frame):
+        """Takes decoded BGR frame `index`, keeping it only if a clip will read it."""
+        self.num_frames = index + 1
+        if index % self.frame_step == 0 and (self.windowed or len(self.frames) < self.n_frames):
+            self.frames.append(to_rgb(frame, self.output_size))
+
+    @property
+    def full(self):
+        """True once no later frame can be kept, so decoding only for these samples can stop."""
+        return not self.windowed and len(self.frames) >= self.n_frames
+
+    @classmethod
+    def from_frames(cls, frames, windowed=None, n_frames=30, frame_step=15):
+        """Samples from an in-memory (N, H, W, 3) RGB array such as decode_frames returns."""
+        samples = cls(windowed, n_frames, frame_step)
+        kept = frames[::frame_step]
+        samples.frames = list(kept if samples.windowed else kept[:n_frames])
+        samples.num_frames = len(frames)
+        return samples
+
+def collect_samples(video_path, windowed=None):
+    """Decodes the video once, keeping only the frames its clips need."""
+    samples = ClipSamples(windowed)
+    for index, frame in iter_frames(video_path):
+        samples.add(index, frame)
+        if samples.full:
+            break
+    return samples
+
+def clip_from(sampled, n_frames=30, output_size=(224, 224)):
+    """Formats up to `n_frames` sampled frames into one clip, zero-padding short videos."""
+    sampled = [format_frames(frame, output_size) for frame in sampled[:n_frames]]
+    if not sampled:
+        sampled = [torch.zeros(3, *output_size)]
+    if len(sampled) < n_frames:
+        padding = [torch.zeros_like(sampled[0]) for _ in range(n_frames - len(sampled))]
+        sampled.extend(padding)
+    return torch.stack(sampled)
+
+def sample_frames(frames, n_frames=30, frame_step=15, output_size=(224, 224)):
+    """Takes every `frame_step`-th decoded frame, up to `n_frames`, zero-padding short videos."""
+    return clip_from(frames[::frame_step], n_frames, output_size)
+
 def extract_frames(video_path, n_frames=30, frame_step=15, output_size=(224, 224)):
-    reader = imageio.get_reader(video_path)
-    frames = []
-    for i, frame in enumerate(reader):
-        if i % frame_step == 0:
-            frame = format_frames(frame, output_size)
-            frames.append(frame)
-            if len(frames) == n_frames:
-                break
-    reader.close()
-    if len(frames) < n_frames:
-        padding = [torch.zeros_like(frames[0]) for _ in range(n_frames - len(frames))]
-        frames.extend(padding)
-    return torch.stack(frames)
-
-def predict(video_path, model_path):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = VideoClassifier().to(device)
-    model.load_state_dict(torch.load(model_path, map_location=device))
+    return clip_from(collect_samples(video_path, windowed=False).frames, n_frames, output_size)
+
+def load_model(model_path, runtime=None):
+    if (runtime or INFERENCE_RUNTIME) == "onnx":
+        return OnnxModel(onnx_path(violence_onnx_name(model_path)))
+    # The checkpoint overwrites every weight, so skip downloading the ImageNet ones.
+    model = VideoClassifier(pretrained=False).to(device)
+    # weights_only refuses pickled objects other than tensors, so a checkpoint cannot run code on load.
+    model.load_state_dict(torch.load(model_path, map_location=device, weights_only=True))
     model.eval()
+    return model
+
+def current_model_path():
+    return registry.resident_source("violence") or DEFAULT_MODEL_PATH
+
+def get_model(model_path=None):
+    """Returns the warm classifier; without a path, whichever checkpoint is resident (or the default) is used."""
+    model_path = model_path or current_model_path()
+    return registry.get("violence", load_model, model_path)
+
+def checkpoint_path(path):
+    """Resolves a reload path under VIOLENCE_CHECKPOINT_ROOT, refusing anything outside it."""
+    root = os.path.realpath(VIOLENCE_CHECKPOINT_ROOT)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Checkpoint path is outside VIOLENCE_CHECKPOINT_ROOT: {path}")
+    return resolved
+
+def reload_model(model_path):
+    """Hot-swaps the resident classifier for a checkpoint under VIOLENCE_CHECKPOINT_ROOT without restarting the server."""
+    model_path = checkpoint_path(model_path)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Checkpoint not found: {model_path}")
+    registry.reload("violence", load_model, model_path)
+    return model_path
+
+def predict(samples, model_path=None):
+    """Classifies the one clip made of the video's first 30 sampled frames."""
+    model = get_model(model_path)
+
+    frames = clip_from(samples.frames).unsqueeze(0).to(device)
     
-    frames = extract_frames(video_path)
-    frames = frames.unsqueeze(0).to(device)
-    
-    with torch.no_grad():
+    with span("violence_forward"), torch.no_grad():
         outputs = model(frames)
         predicted_class = torch.argmax(outputs, dim=1).item()
     return CFG.classes[predicted_class]
 
-def main(model_path, video_path):
-    label = predict(video_path, model_path)
+def window_starts(num_frames, n_frames=30, frame_step=15, stride=VIOLENCE_WINDOW_STRIDE, max_windows=VIOLENCE_MAX_WINDOWS):
+    """Start frames of overlapping clips that cover the whole video, capped at `max_windows`.
+
+    Starts fall on multiples of `frame_step`, the only frames ClipSamples keeps, so the last
+    window can end up to `frame_step - 1` frames before the end of the video.
+    """
+    span = (n_frames - 1) * frame_step + 1
+    last = max(0, num_frames - span) // frame_step * frame_step
+    starts = list(range(0, last + 1, stride))
+    if starts[-1] != last:
+        starts.append(last)
+    if len(starts) > max_windows:
+        starts = [0] if max_windows == 1 else [round(i * last / (max_windows - 1)) for i in range(max_windows)]
+    return sorted({start // frame_step * frame_step for start in starts})
+
+def clip_at(sampled, start, formatted, n_frames=30, frame_step=15, output_size=(224, 224)):
+    """The zero-padded clip of `n_frames` frames from frame `start`, a multiple of `frame_step`.
+
+    `sampled` holds every `frame_step`-th frame of the video; `formatted` caches the formatted
+    frames that overlapping clips share, keyed by their position in `sampled`.
+    """
+    first = start // frame_step
+    indices = range(first, min(len(sampled), first + n_frames))
+    tensors = [formatted.setdefault(i, format_frames(sampled[i], output_size)) for i in indices]
+    if not tensors:
+        tensors = [torch.zeros(3, *output_size)]
+    tensors += [torch.zeros_like(tensors[0]) for _ in range(n_frames - len(tensors))]
+    return torch.stack(tensors)
+
+def iter_clips(sampled, starts, n_frames=30, frame_step=15, output_size=(224, 224)):
+    """Yields the clip at each of the ascending `starts`, formatting every frame once.
+
+    Overlapping clips share formatted frames; frames before the current start are dropped, so at
+    most one window's frames are held however long the video is.
+    """
+    formatted = {}
+    for start in starts:
+        for index in [index for index in formatted if index < start // frame_step]:
+            del formatted[index]
+        yield clip_at(sampled, start, formatted, n_frames, frame_step, output_size)
+
+def score_clips(clips, model, batch_size=VIOLENCE_WINDOW_BATCH):
+    """Violence probability of each clip in an iterable, running `batch_size` clips per forward pass."""
+    violence_idx = CFG.classes.index("Violence")
+    probabilities, pending = [], []
+
+    def flush():
+        verdict.check()
+        batch = torch.stack(pending).to(device)
+        with span("violence_forward"), torch.no_grad():
+            probabilities.extend(torch.softmax(model(batch), dim=1)[:, violence_idx].tolist())
+        pending.clear()
+        emit("progress", stage="violence", done=len(probabilities))
+
+    for clip in clips:
+        pending.append(clip)
+        if len(pending) == batch_size:
+            flush()
+    if pending:
+        flush()
+    return probabilities
+
+def window_entries(starts, probabilities, num_frames, fps, n_frames=30, frame_step=15):
+    span = (n_frames - 1) * frame_step + 1
+    return [{
+        "start": round(start / fps, 2),
+        "end": round(min(num_frames, start + span) / fps, 2),
+        "violence": round(probability, 4),
+    } for start, probability in zip(starts, probabilities)]
+
+def windows_label(windows):
+    return "Violence" if any(w["violence"] >= VIOLENCE_WINDOW_THRESHOLD for w in windows) else "NonViolence"
+
+def predict_windows(samples, fps, model_path=None, n_frames=30, frame_step=15, output_size=(224, 224)):
+    """Scores overlapping clips over the whole video, several clips per forward pass.
+
+    `samples` is a windowed ClipSamples. Returns the aggregated label and one {"start", "end",
+    "violence"} entry per window, with times in seconds and the window's violence probability.
+    """
+    model = get_model(model_path)
+    starts = window_starts(samples.num_frames, n_frames, frame_step)
+    clips = iter_clips(samples.frames, starts, n_frames, frame_step, output_size)
+    windows = window_entries(starts, score_clips(clips, model), samples.num_frames, fps, n_frames, frame_step)
+    label = windows_label(windows)
+    logger.info(f"Scored {len(windows)} violence windows: {label}")
+    return label, windows
+
+@span("violence_batch")
+def predict_batch(videos, model_path=None, windowed=None):
+    """Scores several videos with their clips packed into shared forward passes.
+
+    `videos` is a list of (ClipSamples, fps) pairs, sampled with the same `windowed` setting.
+    Returns one (label, windows) pair per video, the same as `main(..., return_windows=True)`
+    would for each video on its own.
+    """
+    windowed = VIOLENCE_WINDOWED if windowed is None else windowed
+    model = get_model(model_path)
+    # Without windowing each video is one clip from its first frame, the same clip `predict` builds.
+    plan = [(video, window_starts(samples.num_frames) if windowed else [0]) for video, (samples, _) in enumerate(videos)]
+
+    def clips():
+        for video, starts in plan:
+            yield from iter_clips(videos[video][0].frames, starts)
+
+    probabilities = score_clips(clips(), model)
+    results, offset = [], 0
+    for video, starts in plan:
+        samples, fps = videos[video]
+        video_probabilities = probabilities[offset:offset + len(starts)]
+        offset += len(starts)
+        if windowed:
+            windows = window_entries(starts, video_probabilities, samples.num_frames, fps or 30.0)
+            results.append((windows_label(windows), windows))
+        else:
+            results.append(("Violence" if video_probabilities[0] >= 0.5 else "NonViolence", []))
+    logger.info(f"Scored {offset} violence clips across {len(videos)} videos")
+    return results
+
+@span("violence")
+def main(model_path=None, video_path=None, frames=None, fps=None, windowed=None, return_windows=False, samples=None):
+    """Returns the video's violence label, and with `return_windows` also its scored windows.
+
+    Frames come from `samples` (a ClipSamples kept during a shared decode), from an in-memory
+    `frames` array, or else from decoding `video_path` while keeping only the frames clips read.
+    """
+    windowed = VIOLENCE_WINDOWED if windowed is None else windowed
+    if samples is None and frames is not None:
+        samples = ClipSamples.from_frames(frames, windowed)
+    elif samples is None:
+        samples, fps = collect_samples(video_path, windowed), video_fps(video_path)
+    if windowed:
+        label, windows = predict_windows(samples, fps or 30.0, model_path)
+    else:
+        label, windows = predict(samples, model_path), []
+    if return_windows:
+        return label, windows
     return label
\ No newline at end of file